@@ -1,38 +1,41 @@
 import pandas as pd
 import logging
 from volatility_mitigation import VolatilityMitigator
-from transactions import BurnTransaction, MintTransaction, SwapTransaction
-import blockchain
+from transactions import BurnTransaction, MintTransaction, SwapTransaction, TransactionStatus, check_swap_reserves
 from settings import PRICE_TOLLERANCE_THRESHOLD
 from big_numbers import expand_to_18_decimals
-from safe_math import q_div, q_encode
-import dsw_oracle
+from safe_math import q_decode_144, q_div, q_encode
+from pool_state_recorder import PoolStateRecorder
+from transaction_sink import OutputFormat
+from arrow_tables import require_pyarrow
+from utils import get_normalized_filename
 
 
 logger = logging.getLogger(__name__)
 
 
 class AMM:
-    def __init__(self, X: str, Y: str, reserve_X: int, reserve_Y: int, is_volatility_mitigator_on: bool) -> None:
-        self.volatility_mitigator = VolatilityMitigator(PRICE_TOLLERANCE_THRESHOLD)
+    def __init__(self, simulation, X: str, Y: str, reserve_X: int, reserve_Y: int, is_volatility_mitigator_on: bool) -> None:
+        self.simulation = simulation
+        self.volatility_mitigator = VolatilityMitigator(simulation, PRICE_TOLLERANCE_THRESHOLD)
         self.X = X
         self.Y = Y
         self.reserve_X = expand_to_18_decimals(reserve_X)
         self.reserve_Y = expand_to_18_decimals(reserve_Y)
         self.price_X_cumulative_last = int(0)
         self.price_Y_cumulative_last = int(0)
-        self.k_last = reserve_X * reserve_Y # todo: update k_last in execute transaction
+        self.k_last = self.reserve_X * self.reserve_Y
         self.is_volatility_mitigator_on = is_volatility_mitigator_on
         self.start_time = None
         self.block_timestamp_last = None 
 
-        self.pool_before_swap_list = []
-        self.pool_after_swap_list = []
+        self.pool_before_swap_states = PoolStateRecorder()
+        self.pool_after_swap_states = PoolStateRecorder()
 
        # self.save_config() todo: uncomment and verify
 
     
-    def reset(self, X, Y, reserve0_X, reserve0_Y, is_volatility_mitigator_on, window_size, period_size, granularity):
+    def reset(self, X, Y, reserve0_X, reserve0_Y, is_volatility_mitigator_on):
         self.X = X
         self.Y = Y
         self.reserve_X = expand_to_18_decimals(reserve0_X)
@@ -44,10 +47,8 @@ class AMM:
         self.start_time = None
         self.block_timestamp_last = None
 
-        self.pool_before_swap_list = []
-        self.pool_after_swap_list = []
-
-        dsw_oracle.reset(window_size, period_size, granularity)
+        self.pool_before_swap_states = PoolStateRecorder()
+        self.pool_after_swap_states = PoolStateRecorder()
 
        # self.save_config()
 
@@ -66,51 +67,222 @@ class AMM:
         return self.reserve_Y
 
     
+    # cumulative prices the pair would have after an update at current_block_timestamp, without updating it (a view, as in Uniswap's oracle library)
     def current_cumulative_prices(self, current_block_timestamp: int):
-        self.price_X_cumulative_last_saved = self.price_X_cumulative_last
-        self.price_Y_cumulative_last_saved = self.price_Y_cumulative_last
-        self.block_timestamp_last_saved = self.block_timestamp_last
-
-        if self.block_timestamp_last != current_block_timestamp:
-            time_elapsed = current_block_timestamp - self.block_timestamp_last
+        if self.block_timestamp_last is None or current_block_timestamp <= self.block_timestamp_last:
+            return self.price_X_cumulative_last, self.price_Y_cumulative_last
 
-            self.price_X_cumulative_last += q_div(q_encode(self.reserve_Y), self.reserve_X) * time_elapsed
-            self.price_Y_cumulative_last += q_div(q_encode(self.reserve_X), self.reserve_Y) * time_elapsed
+        time_elapsed = current_block_timestamp - self.block_timestamp_last
 
-            self.block_timestamp_last = current_block_timestamp # TODO: ?
-        
-        return self.price_X_cumulative_last, self.price_Y_cumulative_last
+        return (self.price_X_cumulative_last + q_div(q_encode(self.reserve_Y), self.reserve_X) * time_elapsed,
+                self.price_Y_cumulative_last + q_div(q_encode(self.reserve_X), self.reserve_Y) * time_elapsed)
 
 
+    # undoes the last update_pair
     def reverse_state(self):
         self.price_X_cumulative_last = self.price_X_cumulative_last_saved
         self.price_Y_cumulative_last = self.price_Y_cumulative_last_saved
-        self.block_timestamp_last = self.block_timestamp_last
+        self.block_timestamp_last = self.block_timestamp_last_saved
         
 
     def swap(self, id, transaction, slippage):
+        blockchain = self.simulation.blockchain
         blockchain.update(int(transaction.datetime_timestamp.timestamp()))
         swap_transaction = SwapTransaction(transaction, slippage, self, id)
                 
         blockchain.receive_transaction(swap_transaction)
 
 
+    # swap_at, mint_at and burn_at take the unix timestamp and the exact amounts directly (see replay_events)
+    def swap_at(self, id, timestamp: int, token_in: str, token_out: str, token_in_amount: int, slippage, sender=None, to=None, desired_token_in_amount=None):
+        blockchain = self.simulation.blockchain
+        blockchain.update(timestamp)
+        swap_transaction = SwapTransaction.from_values(self, id, timestamp, token_in, token_out, token_in_amount, slippage, sender, to, desired_token_in_amount)
+
+        blockchain.receive_transaction(swap_transaction)
+
+
+    # quoted status of the swap in the block it would be sent to. The blockchain is moved to that block, as swap does,
+    # the swap itself is only quoted
     def verify_swap(self, id, transaction, slippage):
+        blockchain = self.simulation.blockchain
         blockchain.update(int(transaction.datetime_timestamp.timestamp()))
-        swap_transaction = SwapTransaction(transaction, slippage, self, id, save_transaction=False)
 
-        return swap_transaction.check_execute_status(blockchain.get_curr_block_timestamp())
+        return self.quote(transaction.token_in, transaction.token_in_amount, blockchain.get_curr_block_timestamp())
+
+
+    # verify_swap of the swap with each of the amounts_in instead of its amount, all in the same block. Returns their statuses and amounts out
+    def verify_swap_amounts(self, transaction, amounts_in):
+        blockchain = self.simulation.blockchain
+        blockchain.update(int(transaction.datetime_timestamp.timestamp()))
+
+        return self.quote_amounts(transaction.token_in, amounts_in, blockchain.get_curr_block_timestamp())
+
+
+    # dry run of a token_in swap of amount_in at block_timestamp: its status from the checks of get_swap_quote (reserves, K and fee checks
+    # and the mitigator's decision), computed from a read-only view of the pair and the oracle. Nothing is updated and no transaction is created
+    def quote(self, token_in: str, amount_in: int, block_timestamp: int) -> TransactionStatus:
+        return self.get_swap_quote(token_in, amount_in, self.get_price_average(token_in, block_timestamp))[0]
+
+
+    # quote of a token_in swap of each of the amounts_in at block_timestamp, all against the same state of the pair and one oracle consult.
+    # Returns their statuses and amounts out
+    def quote_amounts(self, token_in: str, amounts_in, block_timestamp: int):
+        price_average = self.get_price_average(token_in, block_timestamp)
+        statuses, amounts_out = [], []
+
+        for amount_in in amounts_in:
+            status, amount_out = self.get_swap_quote(token_in, amount_in, price_average)
+            statuses.append(status)
+            amounts_out.append(amount_out)
+
+        return statuses, amounts_out
 
     
+    # largest amount_in in [0, max_amount_in] of a token_in swap which get_swap_quote lets through at block_timestamp, the result of
+    # the bisection over that range with the checks (0 if no amount passes). The oracle is consulted once, nothing is updated
+    def get_max_allowed_amount_in(self, token_in: str, block_timestamp: int, max_amount_in: int) -> int:
+        is_allowed, low_known, high_known, monotone_from = self.get_swap_checks(token_in, block_timestamp, max_amount_in)
+
+        return bisect_last_allowed(is_allowed, max_amount_in, low_known, high_known, monotone_from)
+
+
+    # largest of the amounts amounts_step * i (0 <= i < amounts_count) of a token_in swap which get_swap_quote lets through at block_timestamp,
+    # as a scan over all of them finds it (0 if none passes). Only the amounts near the boundary and below the monotone ones are checked
+    def get_last_allowed_amount_in(self, token_in: str, block_timestamp: int, amounts_step: int, amounts_count: int) -> int:
+        max_amount_in = amounts_step * (amounts_count - 1)
+        is_allowed, low_known, high_known, monotone_from = self.get_swap_checks(token_in, block_timestamp, max_amount_in)
+
+        for i in range(min(amounts_count - 1, (high_known - 1) // amounts_step), 0, -1):
+            amount_in = i * amounts_step
+
+            if monotone_from <= amount_in <= low_known or is_allowed(amount_in):
+                return amount_in
+
+        return 0
+
+
+    # the check of the swaps in [0, max_amount_in] and the amounts it is known for without checking them: [monotone_from, low_known]
+    # are allowed and [high_known, max_amount_in] are not (see known_checks_bounds)
+    def get_swap_checks(self, token_in: str, block_timestamp: int, max_amount_in: int):
+        price_average = self.get_price_average(token_in, block_timestamp)
+        is_allowed = lambda amount_in: self.is_swap_allowed(token_in, amount_in, price_average)
+        estimate, margin, monotone_from = self.estimate_max_allowed_amount_in(token_in, price_average, max_amount_in)
+
+        return (is_allowed, *known_checks_bounds(is_allowed, max_amount_in, estimate, margin, monotone_from), monotone_from)
+
+
+    # the oracle's price average of token_in the mitigator checks the swaps at block_timestamp with (None if it doesn't check them)
+    def get_price_average(self, token_in: str, block_timestamp: int):
+        if not self.is_volatility_mitigator_on:
+            return None
+
+        dsw_oracle = self.volatility_mitigator.get_dsw_oracle()
+
+        if not dsw_oracle.can_consult(block_timestamp):
+            return None
+
+        return dsw_oracle.consult_price_average(token_in, block_timestamp)
+
+
+    # status and amount out a token_in swap of amount_in would get from the checks of try_execute, without the slippage check and with
+    # the mitigator's decision taken against price_average (as returned by get_price_average)
+    def get_swap_quote(self, token_in: str, amount_in: int, price_average: int):
+        amount_out, reserve_out_final, status = check_swap_reserves(self, token_in, amount_in)
+
+        if status is not None:
+            return status, amount_out
+
+        if price_average is not None and self.volatility_mitigator.is_blocked(amount_out, reserve_out_final, q_decode_144(price_average * amount_in)):
+            return TransactionStatus.BLOCKED_BY_VOLATILITY_MITIGATION, amount_out
+
+        return TransactionStatus.SUCCESS, amount_out
+
+
+    def is_swap_allowed(self, token_in: str, amount_in: int, price_average: int) -> bool:
+        return self.get_swap_quote(token_in, amount_in, price_average)[0] == TransactionStatus.SUCCESS
+
+
+    # boundary of the allowed amounts from the constant product amount out O(a) = 990 a r_out / (1000 r_in + 990 a). Without the mitigator only the reserves
+    # limit the swap, otherwise it blocks once 200 (W - O) >= (limit + 1) (W + O) for the oracle's amount out W(a) = P a / 2**112 (W > O, above the amount
+    # where W(a) = O(a)). Also returns the margin past which the rounding of the amounts doesn't change the checks any more and the amount from which
+    # they are monotone ((None, 1, 0) if there isn't any boundary to estimate)
+    def estimate_max_allowed_amount_in(self, token_in: str, price_average: int, max_amount_in: int):
+        reserve_in, reserve_out = (self.reserve_X, self.reserve_Y) if token_in == self.X else (self.reserve_Y, self.reserve_X)
+
+        if reserve_in <= 0 or reserve_out <= 0 or price_average == 0:
+            return None, 1, 0
+
+        if price_average is None:
+            # the amount out and the system fee (0.4% of it) take the whole reserve out
+            amount_out = reserve_out * 1000 // 1004 if token_in == self.X else reserve_out - 1
+
+            return min(get_amount_in(amount_out, reserve_in, reserve_out), max_amount_in), 1, 0
+
+        mitigator = self.volatility_mitigator
+        system_fee_permille = 1004 if token_in == self.X else 1000
+
+        # the last amount with the limit of the slice factor k, if the amounts with it are allowed at all
+        def get_boundary(k):
+            out_amounts_diff_limit = mitigator.get_out_amounts_diff_limit(k)
+            numerator = (990 << 112) * reserve_out * (201 + out_amounts_diff_limit) - price_average * (199 - out_amounts_diff_limit) * 1000 * reserve_in
+
+            return numerator // (price_average * (199 - out_amounts_diff_limit) * 990)
+
+        # the first amount with a slice factor >= k (100 (R - O) < (101 - k) R for the final reserve out R)
+        def get_slice_factor_amount_in(k):
+            if k == 0:
+                return 0
+
+            amount_out = (k - 1) * reserve_out * 1000 // (100000 + (k - 1) * system_fee_permille) + 1
+
+            if k > 100 or amount_out >= reserve_out:
+                return max_amount_in + 1
+
+            return get_amount_in(amount_out, reserve_in, reserve_out)
+
+        # the limits decrease with the slice factor: the first slice factor whose amounts are all blocked
+        low, high = 0, 101
+
+        while low < high:
+            k = (low + high) // 2
+
+            if get_boundary(k) < get_slice_factor_amount_in(k):
+                high = k
+            else:
+                low = k + 1
+
+        estimate = min(max(min(get_boundary(low - 1), get_slice_factor_amount_in(low) - 1) if low > 0 else 0, 0), max_amount_in)
+        amount_out = check_swap_reserves(self, token_in, estimate)[0]
+
+        # W(a) = O(a) and the smallest amounts with W(a), O(a) >= 2**20, the difference of the rounded amounts keeps 4 digits there
+        crossing = max(((990 << 112) * reserve_out // price_average - 1000 * reserve_in) // 990 + 1, 0)
+        min_oracle_amount_in = -(-(1 << 132) // price_average)
+        min_amount_in = get_amount_in(1 << 20, reserve_in, reserve_out) + 1 if reserve_out > 1 << 20 else max_amount_in + 1
+        margin = (1 << 16) + (reserve_out << 120) // (price_average * max(amount_out, 1))
+
+        return estimate, margin, max(crossing, min_oracle_amount_in, min_amount_in)
+
+
     def mint(self, amount_X, amount_Y, timestamp, id):
-        blockchain.update(int(timestamp.timestamp()))
+        self.mint_at(amount_X, amount_Y, int(timestamp.timestamp()), id)
+
+
+    def mint_at(self, amount_X, amount_Y, timestamp: int, id):
+        blockchain = self.simulation.blockchain
+        blockchain.update(timestamp)
         mint_transaction = MintTransaction(amount_X, amount_Y, timestamp, self, id)
 
         blockchain.receive_transaction(mint_transaction)
 
 
     def burn(self, amount_X, amount_Y, timestamp, id):
-        blockchain.update(int(timestamp.timestamp()))
+        self.burn_at(amount_X, amount_Y, int(timestamp.timestamp()), id)
+
+
+    def burn_at(self, amount_X, amount_Y, timestamp: int, id):
+        blockchain = self.simulation.blockchain
+        blockchain.update(timestamp)
         burn_transaction = BurnTransaction(amount_X, amount_Y, timestamp, self, id)
 
         blockchain.receive_transaction(burn_transaction)
@@ -118,23 +290,28 @@ class AMM:
 
     def save_pool_state(self, before_swap: bool, transaction_id: int):
         if before_swap:
-            list = self.pool_before_swap_list
+            pool_states = self.pool_before_swap_states
         else:
-            list = self.pool_after_swap_list
+            pool_states = self.pool_after_swap_states
 
-        list.append([transaction_id, self.reserve_X, self.reserve_Y, self.k_last, self.price_X_cumulative_last, self.price_Y_cumulative_last, self.is_volatility_mitigator_on])
+        pool_states.record(transaction_id, self.reserve_X, self.reserve_Y, self.k_last, self.price_X_cumulative_last, self.price_Y_cumulative_last, self.is_volatility_mitigator_on)
 
 
+    # normalize also writes <filename>_normalized.csv for both files (as utils.normalize_pool_state does) from the recorded columns
+    def export_pool_states_to_csv(self, filename_before, filename_after, normalize=False, normalized_index=True):
+        self.export_pool_states(filename_before, filename_after, OutputFormat.CSV, normalize, normalized_index)
 
-    def export_pool_states_to_csv(self, filename_before, filename_after):
-        before_df = pd.DataFrame(self.pool_before_swap_list, columns=['transaction_id', 'reserve_X', 'reserve_Y', 'k', 'price_X_cumulative', 
-                                                                        'price_Y_cumulative', 'is_volatility_mitigator_on'])
 
-        after_df = pd.DataFrame(self.pool_after_swap_list, columns=['transaction_id', 'reserve_X', 'reserve_Y', 'k', 'price_X_cumulative', 
-                                                                        'price_Y_cumulative', 'is_volatility_mitigator_on'])
+    def export_pool_states(self, filename_before, filename_after, output_format=OutputFormat.CSV, normalize=False, normalized_index=True):
+        for pool_states, filename in [(self.pool_before_swap_states, filename_before), (self.pool_after_swap_states, filename_after)]:
+            if output_format == OutputFormat.PARQUET:
+                _, pq = require_pyarrow()
+                pq.write_table(pool_states.to_arrow_table(), filename)
+            else:
+                pool_states.to_dataframe().to_csv(filename, index=False)
 
-        before_df.to_csv(filename_before, index=False)
-        after_df.to_csv(filename_after, index=False)
+            if normalize:
+                pool_states.to_normalized_dataframe().to_csv(get_normalized_filename(filename), index=normalized_index)
 
 
 
@@ -154,23 +331,18 @@ class AMM:
         self.k_last = self.reserve_X * self.reserve_Y
 
 
-    def update_pair(self, block_timestamp): # todo: remove duplicate code (from current_acc_prices)
+    def update_pair(self, block_timestamp):
         # true only on first function call
         if self.block_timestamp_last == None:
             self.block_timestamp_last = block_timestamp
             self.start_time = block_timestamp
 
-        time_elapsed = block_timestamp - self.block_timestamp_last
-
         self.price_X_cumulative_last_saved = self.price_X_cumulative_last
         self.price_Y_cumulative_last_saved = self.price_Y_cumulative_last
         self.block_timestamp_last_saved = self.block_timestamp_last
 
-        if time_elapsed > 0:
-            self.price_X_cumulative_last += q_div(q_encode(self.reserve_Y), self.reserve_X) * time_elapsed
-            self.price_Y_cumulative_last += q_div(q_encode(self.reserve_X), self.reserve_Y) * time_elapsed
-
-        self.block_timestamp_last = block_timestamp # TODO: maybe remove blocktimestamplast assign in get method
+        self.price_X_cumulative_last, self.price_Y_cumulative_last = self.current_cumulative_prices(block_timestamp)
+        self.block_timestamp_last = block_timestamp
 
 
     def save_config(self, filename):
@@ -180,21 +352,92 @@ class AMM:
             f.write(f"reserve_X = `{self.reserve_X}`\n")
             f.write(f"reserve_Y = `{self.reserve_Y}`\n")
             f.write(f"is_volatility_mitigator_on = `{self.is_volatility_mitigator_on}`")
- 
-
-_amm = AMM("X", "Y", 800000, 800000, True)
-
-
-current_cumulative_prices = _amm.current_cumulative_prices
-swap = _amm.swap
-verify_swap = _amm.verify_swap
-X = _amm.get_X
-Y = _amm.get_Y
-reserve_X = _amm.get_reserve_X
-reserve_Y = _amm.get_reserve_Y
-save_pool_state = _amm.save_pool_state
-export_pool_states_to_csv = _amm.export_pool_states_to_csv
-reset = _amm.reset
-mint = _amm.mint
-burn = _amm.burn
-reverse_state = _amm.reverse_state
\ No newline at end of file
+
+
+# amount in of a swap with the amount out amount_out (inverse of transactions.get_amount_out, up to the rounding)
+def get_amount_in(amount_out: int, reserve_in: int, reserve_out: int) -> int:
+    return 1000 * reserve_in * amount_out // (990 * (reserve_out - amount_out))
+
+
+# amounts in [monotone_from, low_known] which are allowed and in [high_known, high] which are not: margin away from the allowed / not allowed pair
+# around the estimate of the boundary found by bracket_boundary, past the rounding of the amounts (-1, high + 1 without an estimate)
+def known_checks_bounds(is_allowed, high: int, estimate: int=None, margin: int=1, monotone_from: int=0):
+    low_known, high_known = -1, high + 1
+
+    if estimate is not None:
+        allowed, not_allowed = bracket_boundary(is_allowed, high, estimate, margin)
+
+        if allowed is not None and allowed >= monotone_from:
+            low_known = allowed - margin
+
+        if not_allowed is not None and not_allowed >= monotone_from:
+            high_known = not_allowed + margin
+
+    return low_known, high_known
+
+
+# result of the bisection over [0, high] for the last allowed amount (low - 1 at its end), as the strategies run it with the swap checks.
+# Only its midpoints outside of the known bounds (see known_checks_bounds) are checked
+def bisect_last_allowed(is_allowed, high: int, low_known: int=-1, high_known: int=None, monotone_from: int=0) -> int:
+    high_known = high + 1 if high_known is None else high_known
+    low = 0
+
+    while low <= high:
+        mid = (low + high) // 2
+
+        if mid >= high_known:
+            is_ok = False
+        elif monotone_from <= mid <= low_known:
+            is_ok = True
+        else:
+            is_ok = is_allowed(mid)
+
+        if is_ok:
+            low = mid + 1
+        else:
+            high = mid - 1
+
+    return low - 1
+
+
+# an allowed and a not allowed amount at most margin apart, searched from the estimate with doubling steps (None for the not allowed
+# amount if high is allowed and for the allowed one if 0 isn't)
+def bracket_boundary(is_allowed, high: int, estimate: int, margin: int):
+    step = margin
+
+    if is_allowed(estimate):
+        allowed = estimate
+
+        while True:
+            if allowed == high:
+                return high, None
+
+            not_allowed = min(allowed + step, high)
+
+            if not is_allowed(not_allowed):
+                break
+
+            allowed, step = not_allowed, step * 2
+    else:
+        not_allowed = estimate
+
+        while True:
+            if not_allowed == 0:
+                return None, 0
+
+            allowed = max(not_allowed - step, 0)
+
+            if is_allowed(allowed):
+                break
+
+            not_allowed, step = allowed, step * 2
+
+    while not_allowed - allowed > margin:
+        middle = (allowed + not_allowed) // 2
+
+        if is_allowed(middle):
+            allowed = middle
+        else:
+            not_allowed = middle
+
+    return allowed, not_allowed
@@ -0,0 +1,96 @@
+from typing import List
+import numpy as np
+
+# pyarrow is imported by require_pyarrow, only when a parquet output is requested
+pa = None
+pq = None
+
+
+# exact integers are stored as decimals with scale 0: amounts and reserves fit into decimal128,
+# k, the q112 encoded prices and the amounts computed from them need decimal256
+DECIMAL128_COLUMNS = {'token_in_amount', 'token_out_amount_min', 'token_out_amount', 'system_fee',
+                      'desired_token_in_amount', 'X_amount', 'Y_amount', 'reserve_X', 'reserve_Y'}
+DECIMAL256_COLUMNS = {'k', 'price_X_cumulative', 'price_Y_cumulative', 'oracle_amount_out', 'oracle_price'}
+STRING_COLUMNS = {'token_in', 'token_out', 'mitigator_check_status', 'status', 'sender', 'to'}
+BOOL_COLUMNS = {'is_volatility_mitigator_on'}
+ID_COLUMNS = {'id', 'txd', 'transaction_id'}
+
+
+# (pyarrow, pyarrow.parquet), the functions of this module use them once they are imported
+def require_pyarrow():
+    global pa, pq
+
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("pyarrow is required for the parquet output format")
+
+        pa, pq = pyarrow, pyarrow.parquet
+
+    return pa, pq
+
+
+def get_arrow_type(column: str, values):
+    if column in DECIMAL128_COLUMNS:
+        return pa.decimal128(38, 0)
+
+    if column in DECIMAL256_COLUMNS:
+        return pa.decimal256(76, 0)
+
+    if column in STRING_COLUMNS:
+        return pa.string()
+
+    if column in BOOL_COLUMNS:
+        return pa.bool_()
+
+    first_value = next((value for value in values if value is not None), 0)
+
+    if column in ID_COLUMNS:
+        # integer counters in most of the runs, uuids in the dynamic simulations
+        return pa.int64() if isinstance(first_value, (int, np.integer)) else pa.string()
+
+    # block numbers, counters and timestamps (ints or datetimes, depending on the driver)
+    return pa.array([first_value]).type
+
+
+def get_arrow_schema(header: List[str], rows: List[list]):
+    require_pyarrow()
+
+    columns = list(zip(*rows)) if len(rows) > 0 else [[] for _ in header]
+
+    return pa.schema([(column, get_arrow_type(column, values)) for column, values in zip(header, columns)])
+
+
+def to_arrow_array(values, arrow_type):
+    if pa.types.is_string(arrow_type):
+        values = [None if value is None else str(value) for value in values]
+
+    return pa.array(values, type=arrow_type)
+
+
+def rows_to_arrow_table(rows: List[list], schema):
+    columns = list(zip(*rows)) if len(rows) > 0 else [[] for _ in schema]
+
+    return pa.Table.from_arrays([to_arrow_array(list(values), field.type) for values, field in zip(columns, schema)], schema=schema)
+
+
+def limbs_to_decimal_array(limbs: np.ndarray, arrow_type):
+    """
+    Builds a decimal array straight from little-endian uint64 limbs (see pool_state_recorder.BigIntColumn),
+    without converting the values to python ints
+    """
+    require_pyarrow()
+
+    size, limbs_count = limbs.shape
+    width = arrow_type.byte_width // 8
+
+    if limbs_count > width and limbs[:, width:].any():
+        raise OverflowError(f"Values don't fit into {arrow_type}")
+
+    # copied, so the recorder buffer isn't pinned by the arrow array and can keep growing
+    data = np.zeros((size, width), dtype='<u8')
+    data[:, :min(limbs_count, width)] = limbs[:, :width]
+
+    return pa.Array.from_buffers(arrow_type, size, [None, pa.py_buffer(data)])
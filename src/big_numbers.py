@@ -1,5 +1,6 @@
 from decimal import *
 from typing import Union
+import numpy as np
 import pandas as pd
 
 def expand_to_18_decimals(n: Union[int, float, str]):
@@ -18,7 +19,184 @@ def expand_to_18_decimals_object(n: Union[int, float, str]):
 
 # todo: check function
 def contract_18_decimals_to_float(n: str):
-    if n is None:
+    if n is None or n == '':
         return None
 
     return float(Decimal(n) / Decimal('1000000000000000000'))
+
+
+def to_char_matrix(values, width: int = 1):
+    """
+    (size, width) uint8 matrix of the characters of integers (or their string forms) zero-padded to the same width.
+    Also returns which values are missing ('' or None).
+    """
+    encoded = pd.Series(values, dtype=object).to_numpy(dtype=object, na_value='').astype(np.bytes_)
+
+    if len(encoded) == 0:
+        return np.zeros((0, width), dtype=np.uint8), np.zeros(0, dtype=bool)
+
+    width = max(encoded.dtype.itemsize, width)
+    chars = np.char.zfill(encoded, width).astype(f'S{width}').view(np.uint8).reshape(len(encoded), width)
+
+    return chars, encoded == b''
+
+
+def contract_decimals_to_float_array(values, decimals: int = 18) -> np.ndarray:
+    """
+    Vectorized contract_18_decimals_to_float for a whole column of integers or their string forms.
+    The decimal point is inserted into the digits, so every value is rounded to float only once.
+    Missing values ('' or None) become NaN.
+    """
+    chars, is_missing = to_char_matrix(values, decimals + 2)
+    size, width = chars.shape
+
+    is_digit = (chars >= ord('0')) & (chars <= ord('9'))
+    is_integer = is_digit[:, 1:].all(axis=1) & (is_digit[:, 0] | (chars[:, 0] == ord('-')))
+
+    fixed_point = np.empty((size, width + 1), dtype=np.uint8)
+    fixed_point[:, :width - decimals] = chars[:, :width - decimals]
+    fixed_point[:, width - decimals] = ord('.')
+    fixed_point[:, width - decimals + 1:] = chars[:, width - decimals:]
+
+    result = np.full(size, np.nan)
+    parsed = is_integer & ~is_missing
+    result[parsed] = fixed_point[parsed].view(f'S{width + 1}').ravel().astype(float)
+
+    # columns written before the exact integer output may contain floats ('1.5e+20')
+    is_float = ~is_integer & ~is_missing
+
+    if is_float.any():
+        result[is_float] = pd.Series(values, dtype=object)[is_float].astype(float).to_numpy() / 10**decimals
+
+    return result
+
+
+def limbs_to_ints(limbs: np.ndarray) -> np.ndarray:
+    """
+    Exact values of (size, limbs) little-endian uint64 limbs as python ints (object array)
+    """
+    values = limbs[:, -1].astype(object)
+
+    for i in range(limbs.shape[1] - 2, -1, -1):
+        values = (values << 64) | limbs[:, i].astype(object)
+
+    return values
+
+
+def ints_to_limbs(values, limbs: int) -> np.ndarray:
+    """
+    (size, limbs) little-endian uint64 limbs of non-negative python ints (inverse of limbs_to_ints)
+    """
+    width = limbs * 8
+
+    return np.frombuffer(b''.join(value.to_bytes(width, 'little') for value in values), dtype='<u8').reshape(len(values), limbs)
+
+
+FIVE_18 = 5 ** 18
+POW10 = np.array([10 ** j for j in range(20)], dtype=np.uint64)
+POW10_OBJECT = np.array([10 ** j for j in range(20)], dtype=object)
+# for an ulp of 2**-s, the finest power of 10 below the width 10**18 / 2**s of the rounding interval of x * 10**18
+FINEST_GRID = np.array([max(j for j in range(18) if 10 ** j * 2 ** s < 10 ** 18) for s in range(59)], dtype=np.int64)
+
+
+def expand_to_18_decimals_array(values) -> np.ndarray:
+    """
+    Vectorized expand_to_18_decimals for a whole column of floats or integers: object array of the exact integers
+    the scalar function returns (None for missing values). Strings and the floats the vectorized path doesn't cover
+    (see expand_floats_to_18_decimals) go through the scalar function.
+    """
+    array = values.to_numpy() if isinstance(values, pd.Series) else np.asarray(values)
+
+    if array.dtype == np.float64:
+        return expand_floats_to_18_decimals(array)
+
+    if array.dtype.kind in 'iu':
+        return array.astype(object) * 10**18
+
+    result = np.full(len(array), None, dtype=object)
+    present = ~pd.isnull(array)
+    kind = pd.api.types.infer_dtype(array[present])
+
+    # other float widths keep the scalar path, str() of their values isn't the one of the float64 ones
+    if kind == 'floating' and array.dtype == object:
+        result[present] = expand_floats_to_18_decimals(array[present].astype(np.float64))
+    elif kind == 'integer':
+        result[present] = array[present].astype(object) * 10**18
+    else:
+        result[present] = [expand_to_18_decimals(value) for value in array[present]]
+
+    return result
+
+
+def expand_floats_to_18_decimals(x: np.ndarray) -> np.ndarray:
+    """
+    str() of a float is its shortest representation which rounds back to it, the scalar path expands those digits.
+    Here that representation is found from the binary value: the shortest decimal in the rounding interval of x,
+    the nearest one when there are several. On the 10**-18 grid, the interval of an x with an ulp between 2**-58 and 1
+    contains integers, a multiple of the finest power of 10 narrower than the interval always and at most one multiple of
+    the next power of 10 - the shortest representation when it exists (every coarser multiple is one of it too)
+    """
+    u = np.uint64
+    bits = x.view(u) & u((1 << 63) - 1)
+    exponent = (bits >> u(52)).astype(np.int64)
+    s = 1075 - exponent
+    M = (bits & u((1 << 52) - 1)) | u(1 << 52)
+    # powers of 2 have an asymmetric rounding interval, they take the scalar path with nan, infinities, zeros and large or tiny values
+    fast = (s >= 0) & (s <= 58) & (M != u(1 << 52))
+    idx = None
+
+    if not fast.all():
+        idx = np.flatnonzero(fast)
+        s, M = s[idx], M[idx]
+
+    # x * 10**18 = A * 10**18 + B + R / 2**rs, B is estimated in floats and corrected by the exact (wrapping) remainder
+    su = s.astype(u)
+    A = M >> su
+    fraction = M - (A << su)
+    rs = np.maximum(s - 18, 0).astype(u)
+    ls = np.maximum(18 - s, 0).astype(u)
+    B = np.floor(fraction.astype(np.float64) * np.ldexp(float(FIVE_18), 18 - s)).astype(u)
+    R = ((fraction * u(FIVE_18)) << ls) - (B << rs)
+    B += (R.view(np.int64) >> rs.view(np.int64)).view(u)
+    R &= (u(1) << rs) - u(1)
+
+    # the nearest multiple of 10**j is in the interval
+    j = FINEST_GRID[s]
+    P = POW10[j]
+    q = B // P
+    low = B - q * P
+    side = (np.clip(2 * low.view(np.int64) - P.view(np.int64), -2, 2) << rs.view(np.int64)) + 2 * R.view(np.int64)
+    N = A * POW10[18 - j] + q + (side > 0)
+    tie = side == 0
+
+    # distances to the multiples of 10**(j + 1) in units of 2**-(rs + 2), the half width of the interval is HK units
+    # (inclusive for even mantissas, as they win the round-half-even)
+    HK = u(FIVE_18) << (ls + u(1))
+    unit = u(4) << rs
+    far = (HK >> (rs + u(2))) + u(2)
+    bound = HK + u(1) - (M & u(1))
+    q1 = q // u(10)
+    low1 = (q - q1 * u(10)) * P + low
+    is_down = np.minimum(low1, far) * unit + (R << u(2)) < bound
+    is_up = np.minimum(P * u(10) - low1, far) * unit - (R << u(2)) < bound
+    coarse = is_down | is_up
+    N = np.where(coarse, A * POW10[17 - j] + q1 + is_up, N)
+    j += coarse
+
+    values = N.astype(object) * POW10_OBJECT[j]
+
+    if idx is None and not tie.any():
+        result = values
+    else:
+        idx = np.arange(len(x)) if idx is None else idx
+        result = np.empty(len(x), dtype=object)
+        result[idx] = values
+        fast[idx[tie]] = False
+
+    negative = np.flatnonzero(fast & (x < 0))
+    result[negative] = -result[negative]
+
+    for i in np.flatnonzero(~fast):
+        result[i] = expand_to_18_decimals(x[i])
+
+    return result
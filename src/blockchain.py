@@ -1,12 +1,10 @@
 from typing import List
 
-import pandas as pd
-from settings import BLOCK_TIME
-from transactions import BurnTransaction, MintTransaction, SwapTransaction, Transaction
-import amm
+from transactions import Transaction
 
 class BlockChain:
-    def __init__(self, avg_block_time: int) -> None:
+    def __init__(self, simulation, avg_block_time: int) -> None:
+        self.simulation = simulation
         self.avg_block_time = avg_block_time
         self.curr_block_number = 0
         self.curr_block_timestamp = None
@@ -19,8 +17,7 @@ class BlockChain:
         if self.curr_block_timestamp is None:
             self.curr_block_timestamp = swap_transaction.timestamp
 
-        while swap_transaction.timestamp > self.curr_block_timestamp: # todo: replace with blockchain.update call outside
-            self.create_block()
+        self.advance_to(swap_transaction.timestamp) # todo: replace with blockchain.update call outside
 
         self.pending_transactions.append(swap_transaction)
         
@@ -29,9 +26,31 @@ class BlockChain:
         if self.curr_block_timestamp is None:
             return
 
-        while next_transaction_timestamp > self.curr_block_timestamp:
+        self.advance_to(next_transaction_timestamp)
+
+
+    # moves the clock to the first block with block_timestamp >= timestamp;
+    # only the current block can hold pending transactions, all the following ones are empty
+    # and are skipped arithmetically instead of being created one by one
+    def advance_to(self, timestamp: int):
+        if timestamp <= self.curr_block_timestamp:
+            return
+
+        if len(self.pending_transactions) > 0:
             self.create_block()
 
+        if timestamp > self.curr_block_timestamp:
+            self.skip_blocks(int(-(-(timestamp - self.curr_block_timestamp) // self.avg_block_time)))
+
+
+    def skip_blocks(self, blocks_count: int):
+        self.curr_block_timestamp += self.avg_block_time * blocks_count
+        self.curr_block_number += blocks_count
+
+
+    def get_curr_block_timestamp(self):
+        return self.curr_block_timestamp
+
 
     def force_finish(self):
         self.create_block()
@@ -40,17 +59,35 @@ class BlockChain:
     def create_block(self):
         self.block_transactions = self.pending_transactions 
         self.pending_transactions = []
-        
-        for transaction in self.block_transactions:
+        self.block_transaction_index = 0
+
+        self.execute_block_transactions()
+
+
+    # resumed is set when the block continues in a fork of the simulation (see multi_oracle_simulation), which was copied
+    # while executing the current transaction, after its before state had been recorded
+    def execute_block_transactions(self, resumed=False):
+        while self.block_transaction_index < len(self.block_transactions):
+            transaction = self.block_transactions[self.block_transaction_index]
             transaction.block_timestamp = self.curr_block_timestamp
-            amm.save_pool_state(True, transaction.id)
+
+            if not resumed:
+                self.simulation.amm.save_pool_state(True, transaction.id)
+
+            resumed = False
             transaction.execute(self.curr_block_timestamp, self.curr_block_number)
-            amm.save_pool_state(False, transaction.id)
+            self.simulation.amm.save_pool_state(False, transaction.id)
+            self.simulation.finalize_transaction(transaction)
+            self.block_transaction_index += 1
 
         self.curr_block_timestamp += self.avg_block_time
         self.curr_block_number += 1
 
 
+    def resume_block(self):
+        self.execute_block_transactions(resumed=True)
+
+
 
     def reset_state(self):
         self.curr_block_number = 0
@@ -58,13 +95,6 @@ class BlockChain:
         self.transaction_history = []
         self.pending_transactions = []
 
-        SwapTransaction.instances = []
-        MintTransaction.instances = []
-        BurnTransaction.instances = []
-
-
-_blockchain = BlockChain(BLOCK_TIME)
-receive_transaction = _blockchain.receive_transaction
-update = _blockchain.update
-reset_state = _blockchain.reset_state
-force_finish = _blockchain.force_finish
\ No newline at end of file
+        self.simulation.swap_transactions = []
+        self.simulation.mint_transactions = []
+        self.simulation.burn_transactions = []
@@ -1,32 +1,22 @@
 import logging
 
-from typing import List
-import amm
-from settings import WINDOW_SIZE, GRANULARITY
+from array import array
+from collections import deque
+from typing import Deque, Tuple
+import numpy as np
 from safe_math import q_decode_144
 
 logger = logging.getLogger(__name__)
 
-class Observation:
-    def __init__(self, timestamp: int, price_X_cumulative: int, price_Y_cumulative: int) -> None:
-        self.timestamp = timestamp
-        self.price_X_cumulative = price_X_cumulative
-        self.price_Y_cumulative = price_Y_cumulative
-
-        logger.debug(f"Observation created at {self.timestamp}, {self}")
-
-
-    def __str__(self) -> str:
-        return f"timestamp={self.timestamp}, price_X_cumulative={self.price_X_cumulative}, price_Y_cumulative={self.price_Y_cumulative}"
-
 
 class DSWOracle:
-    def __init__(self, window_size: int, granularity: int) -> None:
+    def __init__(self, simulation, window_size: int, granularity: int) -> None:
+        self.simulation = simulation
         self.window_size = window_size
         self.fallback_window_size = window_size * 2
         self.granularity = granularity
         self.period_size = window_size // granularity
-        self.observations:List[Observation] = []
+        self.allocate_observations()
 
         assert window_size % granularity == 0, "ERROR: WINDOW_SIZE not divisible by GRANULARITY"
 
@@ -34,9 +24,10 @@ class DSWOracle:
 
     def reset(self, window_size, period_size, granularity):
         self.window_size = window_size
+        self.fallback_window_size = window_size * 2
         self.period_size = period_size
         self.granularity = granularity
-        self.observations = []
+        self.allocate_observations()
 
         assert window_size % granularity == 0, "ERROR: WINDOW_SIZE not divisible by GRANULARITY"
         assert window_size // granularity == period_size, "ERROR: GRANULARITY, PERIOD_SIZE MISMATCH"
@@ -44,6 +35,34 @@ class DSWOracle:
         print(self.window_size, self.period_size, self.granularity)
 
 
+    # observations are kept in a ring buffer of granularity slots (structure of arrays), slot i holds the observation
+    # of the last period with observation_index_of(period start) == i. Cumulative prices don't fit into int64, so they are
+    # kept in object arrays; updates only replace the slot values
+    def allocate_observations(self):
+        self.observation_timestamps = array('q', bytes(8 * self.granularity))
+        self.observation_prices_X_cumulative = np.zeros(self.granularity, dtype=object)
+        self.observation_prices_Y_cumulative = np.zeros(self.granularity, dtype=object)
+        self.has_observations = False
+
+        # (timestamp, index) of the observation writes in time order, see get_fallback_observation_offset_index
+        self.fallback_candidates:Deque[Tuple[int, int]] = deque((0, i) for i in range(self.granularity))
+        self.fallback_lookup_timestamp = 0
+        self.clear_consult_cache()
+
+
+    # every swap of a block consults the oracle at the same block_timestamp: can_consult and the price averages of both tokens are
+    # kept for the last one. They change only with the observations, and the cumulative prices of the pair only with its updates
+    # (block_timestamp_last), as its reserves change after an update at the block's timestamp
+    def clear_consult_cache(self):
+        self.can_consult_cache = None
+        self.price_averages_cache = None
+
+
+    # zero-copy views of the ring buffer (timestamps, price_X_cumulative, price_Y_cumulative), indexed by slot
+    def get_observations(self):
+        return np.frombuffer(self.observation_timestamps, dtype=np.int64), self.observation_prices_X_cumulative, self.observation_prices_Y_cumulative
+
+
     def observation_index_of(self, timestamp: int):
         epoch_period = timestamp // self.period_size #
 
@@ -52,62 +71,72 @@ class DSWOracle:
 
     # updates on the first call per block price accumulators
     def update(self, block_timestamp: int):
-        for i in range(len(self.observations), self.granularity):
-            self.observations.append(Observation(0, 0, 0))
+        if not self.has_observations:
+            self.has_observations = True
+            self.clear_consult_cache()
 
         observation_index = self.observation_index_of(block_timestamp)
-        observation = self.observations[observation_index]
 
-        time_elapsed = block_timestamp - observation.timestamp
+        time_elapsed = block_timestamp - self.observation_timestamps[observation_index]
 
         if time_elapsed > self.period_size:
-            price_X_cumulative, price_Y_cumulative = amm.current_cumulative_prices(block_timestamp)
-            observation.timestamp = block_timestamp
-            observation.price_X_cumulative = price_X_cumulative
-            observation.price_Y_cumulative = price_Y_cumulative
+            price_X_cumulative, price_Y_cumulative = self.simulation.amm.current_cumulative_prices(block_timestamp)
+            self.observation_timestamps[observation_index] = block_timestamp
+            self.observation_prices_X_cumulative[observation_index] = price_X_cumulative
+            self.observation_prices_Y_cumulative[observation_index] = price_Y_cumulative
+            self.clear_consult_cache()
+
+            if len(self.fallback_candidates) > 0 and self.fallback_candidates[-1][0] > block_timestamp:
+                self.rebuild_fallback_candidates()
+            else:
+                self.fallback_candidates.append((block_timestamp, observation_index))
 
-            logger.debug(f"Inside update, time_elapsed={time_elapsed}, updated observation: {observation}")
+            logger.debug("Inside update, time_elapsed=%s, updated observation %s: timestamp=%s, price_X_cumulative=%s, price_Y_cumulative=%s",
+                         time_elapsed, observation_index, block_timestamp, price_X_cumulative, price_Y_cumulative)
 
 
+    # the oldest observation inside the fallback window, which isn't from the current block (offset_index = its index + 1, 0 if there is none).
+    # Observations are written in time order, so it's the first write in fallback_candidates which is neither
+    # overwritten yet nor older than the window; the writes skipped here can't become the fallback observation again
+    # as long as block_timestamp doesn't decrease
     def get_fallback_observation_offset_index(self, block_timestamp):
-        reference_timestamp = block_timestamp
+        if block_timestamp < self.fallback_lookup_timestamp:
+            self.rebuild_fallback_candidates()
+
+        self.fallback_lookup_timestamp = block_timestamp
         boundary_timestamp = block_timestamp - self.fallback_window_size
+        candidates = self.fallback_candidates
+
+        while len(candidates) > 0:
+            timestamp, index = candidates[0]
+
+            if timestamp >= boundary_timestamp and self.observation_timestamps[index] == timestamp:
+                return index + 1 if timestamp < block_timestamp else 0
+
+            candidates.popleft()
 
-        offset_index = 0
+        return 0
 
-        for i in range(0, len(self.observations)):
-            timestamp = self.observations[i].timestamp
 
-            if timestamp >= boundary_timestamp and timestamp < reference_timestamp:
-                reference_timestamp = timestamp
-                offset_index = i+1
+    def rebuild_fallback_candidates(self):
+        self.fallback_candidates = deque(sorted((timestamp, i) for i, timestamp in enumerate(self.observation_timestamps)))
 
-        return offset_index
 
-    def get_fallback_observation(self, block_timestamp):
+    def get_fallback_observation_index(self, block_timestamp):
         offset_index = self.get_fallback_observation_offset_index(block_timestamp)
 
         assert offset_index > 0, 'Invalid offset'
 
-        fallback_observation = self.observations[offset_index - 1]
-
-        return fallback_observation
+        return offset_index - 1
 
     def has_fallback_observation(self, block_timestamp):
         return self.get_fallback_observation_offset_index(block_timestamp) > 0
 
-    
-    def get_first_observation_in_window(self, block_timestamp: int) -> Observation:
-        logger.debug(f"Inside get_first_observation_in_window, block_timestamp: {block_timestamp}")
 
+    def get_first_observation_index_in_window(self, block_timestamp: int) -> int:
         observation_index = self.observation_index_of(block_timestamp)
-        first_observation_index = (observation_index + 1) % self.granularity
-        first_observation = self.observations[first_observation_index]
-
 
-        logger.debug(f"First observation: {first_observation}")
-
-        return first_observation
+        return (observation_index + 1) % self.granularity
 
 
     def compute_amount_out(self, price_comulative_start: int, price_comulative_end: int, time_elapsed: int, amount_in: int):
@@ -118,12 +147,19 @@ class DSWOracle:
 
 
     def can_consult(self, block_timestamp):
-        if len(self.observations) <= 0:
+        if self.can_consult_cache is None or self.can_consult_cache[0] != block_timestamp:
+            self.can_consult_cache = (block_timestamp, self.compute_can_consult(block_timestamp))
+
+        return self.can_consult_cache[1]
+
+
+    def compute_can_consult(self, block_timestamp):
+        if not self.has_observations:
             return False
 
-        first_observation = self.get_first_observation_in_window(block_timestamp)
+        first_observation_index = self.get_first_observation_index_in_window(block_timestamp)
 
-        time_elapsed = block_timestamp - first_observation.timestamp
+        time_elapsed = block_timestamp - self.observation_timestamps[first_observation_index]
        # logger.info(f'{time_elapsed}, {self.window_size}, {block_timestamp}, {first_observation.timestamp}')
 
         return time_elapsed <= self.window_size or self.has_fallback_observation(block_timestamp)
@@ -131,15 +167,32 @@ class DSWOracle:
 
 
     def consult(self, token_in: str, amount_in: int, token_out: str, block_timestamp: int):
-        first_observation = self.get_first_observation_in_window(block_timestamp)
+        price_average = self.consult_price_average(token_in, block_timestamp)
+
+        return q_decode_144(price_average * amount_in), q_decode_144(price_average * 1000000000000000000)
+
 
-        _window_size = self.window_size 
-        first_observation = self.get_first_observation_in_window(block_timestamp)
-        time_elapsed = block_timestamp - first_observation.timestamp
+    # time weighted average price of token_in (UQ112x112) consult computes the amounts out from
+    def consult_price_average(self, token_in: str, block_timestamp: int):
+        key = (block_timestamp, self.simulation.amm.block_timestamp_last)
+
+        if self.price_averages_cache is None or self.price_averages_cache[0] != key:
+            self.price_averages_cache = (key, self.compute_price_averages(block_timestamp))
+
+        price_X_average, price_Y_average = self.price_averages_cache[1]
+
+        return price_X_average if self.simulation.amm.X == token_in else price_Y_average
+
+
+    # time weighted average prices of both tokens at block_timestamp
+    def compute_price_averages(self, block_timestamp: int):
+        _window_size = self.window_size
+        first_observation_index = self.get_first_observation_index_in_window(block_timestamp)
+        time_elapsed = block_timestamp - self.observation_timestamps[first_observation_index]
 
         if time_elapsed > _window_size:
-            first_observation = self.get_fallback_observation(block_timestamp)
-            time_elapsed = block_timestamp - first_observation.timestamp
+            first_observation_index = self.get_fallback_observation_index(block_timestamp)
+            time_elapsed = block_timestamp - self.observation_timestamps[first_observation_index]
             _window_size = self.fallback_window_size
 
 
@@ -147,17 +200,7 @@ class DSWOracle:
         assert time_elapsed <= _window_size, 'SlidingWindowOracle: MISSING_HISTORICAL_OBSERVATION, can`t consult'
         assert time_elapsed >= _window_size - self.period_size * 2 or _window_size == self.fallback_window_size, f'Unexpected TIME_ELAPSED = {time_elapsed}, min allowed: {_window_size - self.period_size * 2}'
 
-        price_X_cumulative, price_Y_cumulative = amm.current_cumulative_prices(block_timestamp)
-
-        if amm.X() == token_in:
-            return self.compute_amount_out(first_observation.price_X_cumulative, price_X_cumulative, time_elapsed, amount_in)
-        else:
-            return self.compute_amount_out(first_observation.price_Y_cumulative, price_Y_cumulative, time_elapsed, amount_in)
-
-
-_dsw_oracle = DSWOracle(WINDOW_SIZE, GRANULARITY)
+        price_X_cumulative, price_Y_cumulative = self.simulation.amm.current_cumulative_prices(block_timestamp)
 
-update = _dsw_oracle.update
-can_consult = _dsw_oracle.can_consult
-consult = _dsw_oracle.consult
-reset = lambda window_size, period_size, granularity: _dsw_oracle.reset(window_size, period_size, granularity)
\ No newline at end of file
+        return ((price_X_cumulative - self.observation_prices_X_cumulative[first_observation_index]) // time_elapsed,
+                (price_Y_cumulative - self.observation_prices_Y_cumulative[first_observation_index]) // time_elapsed)
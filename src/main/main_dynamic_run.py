@@ -6,16 +6,14 @@ import json
 import logging
 import shutil
 import numpy as np
-import scipy
-import amm
 import os
 import uuid
 
-from trading_simulation import Transaction
+from trading_simulation import Transaction, WeibullGenerator, get_poisson_timestamps
 from big_numbers import contract_18_decimals_to_float, expand_to_18_decimals
 from transactions import SwapTransaction, TransactionStatus
-from utils import get_reserve_range_index, get_reserve_range_index2, normalize_csv, normalize_pool_state, parse_dynamic_config, save_dict
-import blockchain
+from simulation import Simulation
+from utils import get_reserve_range_index, parse_dynamic_config, save_dict
 
 
 logging.basicConfig(level=logging.ERROR, format='%(asctime)s:%(name)s:%(message)s', datefmt="%m/%d/%Y %I:%M:%S %p")
@@ -33,6 +31,7 @@ WINDOW_SIZE = 24
 GRANULARITY = 24
 PRICE_TOLLERANCE_THRESHOLD = 98
 DEFAULT_SLIPPAGE = 100
+WARM_UP_DAYS = 1
 
 def main(): 
     logger.info("starting dynamic simulation...")
@@ -59,28 +58,28 @@ def main():
 
     for initial_reserves in [500, 5500, 30000, 75000, 150000, 350000, 750000, 5500000, 505000000]:
         for i in range(len(reserve_range_params_list[0]['shape'])):
-            scale_list = []
-            shape_list = []
-
-            for reserve_range_params in reserve_range_params_list:
-                scale = reserve_range_params['scale'][i]
-                shape = reserve_range_params['shape'][i]
-
-                scale_list.append(scale)
-                shape_list.append(shape)
+            # (shape, scale) of every reserve range
+            reserve_range_params = [(params['shape'][i], params['scale'][i]) for params in reserve_range_params_list]
 
             os.makedirs(f'{BASE_DIR}/{iteration}')       
             transactions = simulate_transactions(start_time)
+            warm_up_end_time = start_time + timedelta(days=WARM_UP_DAYS)
+            warm_up_transactions_count = len([transaction for transaction in transactions if transaction[0] <= warm_up_end_time])
+
+            simulations = {vm: Simulation(X_NAME, Y_NAME, initial_reserves // INITIAL_SEC_PRICE , initial_reserves, vm, WINDOW_SIZE * 60 * 60, WINDOW_SIZE * 60 * 60// GRANULARITY, GRANULARITY) #todo: beautify
+                           for vm in [False, True]}
+
+            reserve_X, reserve_Y = contract_18_decimals_to_float(simulations[False].amm.reserve_X), contract_18_decimals_to_float(simulations[False].amm.reserve_Y) # todo: convert to float
+            
+            shape_, scale_ = reserve_range_params[get_reserve_range_index(reserve_Y)]
+
+            # the amounts only depend on the distribution of the initial reserve range, they are computed once for all the variants
+            # (the warm-up ones are divided)
+            amounts = get_amounts(transactions, warm_up_transactions_count, shape_, scale_)
             
-            for subindex, vm in enumerate([False, True]):
+            for subindex, (vm, simulation) in enumerate(simulations.items()):
                 os.makedirs(f'{BASE_DIR}/{iteration}/{subindex}')
-                amm.reset(X_NAME, Y_NAME, initial_reserves // INITIAL_SEC_PRICE , initial_reserves, vm, WINDOW_SIZE * 60 * 60, WINDOW_SIZE * 60 * 60// GRANULARITY, GRANULARITY) #todo: beautify
 
-                reserve_X, reserve_Y = contract_18_decimals_to_float(amm.reserve_X()), contract_18_decimals_to_float(amm.reserve_Y()) # todo: convert to float
-                
-                reserve_range_index_ = get_reserve_range_index(reserve_Y)
-                shape_ = shape_list[reserve_range_index_]
-                scale_ = scale_list[reserve_range_index_]
                 config['volatility_mitigator'] = vm
                 config['shape'] = shape_
                 config['scale'] = scale_
@@ -88,68 +87,47 @@ def main():
 
                 save_dict(f'{BASE_DIR}/{iteration}/{subindex}/config.json', config)
 
-                for timestamp, cummulative_freq, scale_deviation, token_in, token_out in transactions:
-                    reserve_X, reserve_Y = contract_18_decimals_to_float(amm.reserve_X()), contract_18_decimals_to_float(amm.reserve_Y()) # todo: convert to float
-                    
-                    reserve_range_index = get_reserve_range_index2(reserve_Y)
-                    shape = shape_list[reserve_range_index]
-                    scale = scale_list[reserve_range_index] * scale_deviation
-
-                    amount_in = scipy.stats.weibull_min.ppf(cummulative_freq, shape_, loc=0, scale=scale_ * scale_deviation)## c freq
-                    amount_in = expand_to_18_decimals(amount_in)
+                send_transactions(simulation, transactions, amounts)
 
-                    if timestamp - start_time <= timedelta(days=1):
-                        amount_in = amount_in // 1000 
+                print(transactions[-1][0])
+                post_send_all_transactions(simulation, sequence_max_allowed_strategy)
                 
-                    transaction = Transaction(timestamp, amount_in, token_in, token_out, txd=uuid.uuid4(),
-                                        sequence_swap_cnt=0, desired_token_in_amount=amount_in, attempt_cnt=0)
+                SwapTransaction.save_all(simulation.swap_transactions, f'{BASE_DIR}/{iteration}/{subindex}/swaps.csv', cols_to_normalize=['token_in_amount', 'token_out_amount', 'token_out_amount_min', 'system_fee', 'oracle_amount_out', 'oracle_price'])
 
-                    pre_send_transaction(transaction)
-                    send_transaction(transaction)
-                    post_send_transaction(transaction)
+                simulation.amm.export_pool_states_to_csv(f'{BASE_DIR}/{iteration}/{subindex}/pool_before_transaction.csv', 
+                                                f'{BASE_DIR}/{iteration}/{subindex}/pool_after_transaction.csv', normalize=True)
 
-                print(transaction.datetime_timestamp)
-                post_send_all_transactions(sequence_max_allowed_strategy)
-                
-                SwapTransaction.save_all(f'{BASE_DIR}/{iteration}/{subindex}/swaps.csv')
-                blockchain.reset_state()
 
-                amm.export_pool_states_to_csv(f'{BASE_DIR}/{iteration}/{subindex}/pool_before_transaction.csv', 
-                                                f'{BASE_DIR}/{iteration}/{subindex}/pool_after_transaction.csv')
+            iteration += 1
 
-                logger.info("Start normalizing...")
-                normalize_csv(f'{BASE_DIR}/{iteration}/{subindex}/swaps.csv', ['token_in_amount', 'token_out_amount', 'token_out_amount_min', 'system_fee', 'oracle_amount_out', 'oracle_price'], f'{BASE_DIR}/{iteration}/{subindex}/swaps_normalized.csv')
-                normalize_pool_state(f'{BASE_DIR}/{iteration}/{subindex}/pool_before_transaction.csv', f'{BASE_DIR}/{iteration}/{subindex}/pool_before_transaction_normalized.csv')
-                normalize_pool_state(f'{BASE_DIR}/{iteration}/{subindex}/pool_after_transaction.csv', f'{BASE_DIR}/{iteration}/{subindex}/pool_after_transaction_normalized.csv')
-                logging.info("Finished normalizing")
 
-            iteration += 1
 
+def get_amounts(transactions, warm_up_transactions_count, shape, scale):
+    cummulative_frequencies = [transaction[1] for transaction in transactions]
+    scale_deviations = [transaction[2] for transaction in transactions]
 
+    amounts = WeibullGenerator(shape, 0, scale).get_amounts(cummulative_frequencies, scale_deviations)
+    amounts[:warm_up_transactions_count] //= 1000
 
-def get_timestamps(start_time, periods, freq):
-    time_between_events = []
-    time_elapsed = 0
+    return amounts
 
-    while (True):
-        values = scipy.stats.expon.rvs(size=1000, scale=1/freq)
 
-        for i in range(len(values)):
-            time_elapsed += values[i]
+def send_transactions(simulation, transactions, amounts):
+    for (timestamp, cummulative_freq, scale_deviation, token_in, token_out), amount_in in zip(transactions, amounts):
+        transaction = Transaction(timestamp, amount_in, token_in, token_out, txd=uuid.uuid4(),
+                            sequence_swap_cnt=0, desired_token_in_amount=amount_in, attempt_cnt=0)
 
-            if (time_elapsed + values[i] > periods):
-                timestamps = [start_time]
-                
-                for x in time_between_events:
-                    timestamps.append(timestamps[-1] + timedelta(hours=x))
-                    
-                return timestamps
+        pre_send_transaction(simulation, transaction)
+        send_transaction(simulation, transaction)
+        post_send_transaction(simulation, transaction)
 
-            time_between_events.append(values[i])
+
+def get_timestamps(start_time, periods, freq):
+    return get_poisson_timestamps(start_time, periods, freq)
 
 
 def get_transactions(start_time, periods, freq): # periouds - hours
-    timestamps = get_timestamps(start_time, periods, freq)
+    timestamps = get_timestamps(start_time, periods, freq).tolist()
     cumulative_values = np.random.uniform(0, 1, len(timestamps))
     
     return cumulative_values, timestamps
@@ -233,46 +211,46 @@ def simulate_transactions(start_time):
     return all_transactions
 
 # strategies
-def pre_send_transaction(transaction, strategy=None):
+def pre_send_transaction(simulation, transaction, strategy=None):
     if strategy == None:
         return
 
-    strategy(transaction)
+    strategy(simulation, transaction)
 
 
-def send_transaction(transaction, strategy=None):
+def send_transaction(simulation, transaction, strategy=None):
     if strategy == None:
         strategy = send_transaction_strategy
 
-    strategy(transaction)
+    strategy(simulation, transaction)
 
     
-def post_send_transaction(transaction, strategy=None):    
+def post_send_transaction(simulation, transaction, strategy=None):    
     if strategy is None:
         return
 
-    strategy(transaction)
+    strategy(simulation, transaction)
 
-def post_send_all_transactions(strategy=None):
+def post_send_all_transactions(simulation, strategy=None):
     if strategy is None:
         return
 
-    strategy()
+    strategy(simulation)
 
 
 # send_transaction STRATEGIES
-def send_transaction_strategy(transaction):
-    amm.swap(transaction.txd, transaction, DEFAULT_SLIPPAGE)
+def send_transaction_strategy(simulation, transaction):
+    simulation.amm.swap(transaction.txd, transaction, DEFAULT_SLIPPAGE)
 
 
-def send_max_allowed_strategy(transaction):
+def send_max_allowed_strategy(simulation, transaction):
     swap_decrease_factor_numerator = 3
     swap_decrease_factor_denominator = 4
 
     for attempt in range(0, 10):
-        if amm.verify_swap(transaction.txd, transaction, DEFAULT_SLIPPAGE) == TransactionStatus.SUCCESS: #or attempt == 9:
+        if simulation.amm.verify_swap(transaction.txd, transaction, DEFAULT_SLIPPAGE) == TransactionStatus.SUCCESS: #or attempt == 9:
             transaction.attempt = attempt
-            amm.swap(transaction.txd, transaction, DEFAULT_SLIPPAGE)
+            simulation.amm.swap(transaction.txd, transaction, DEFAULT_SLIPPAGE)
 
             break
         transaction.token_in_amount = transaction.token_in_amount * swap_decrease_factor_numerator // swap_decrease_factor_denominator
@@ -280,62 +258,40 @@ def send_max_allowed_strategy(transaction):
 # post_transaction STRATEGIES
 
 # post_all_transactions STRATEGIES
-def sequence_max_allowed_strategy():
-    last_timestamp = datetime.fromtimestamp(blockchain.get_curr_block_timestamp()) + timedelta(seconds=60)
+def sequence_max_allowed_strategy(simulation):
+    last_timestamp = datetime.fromtimestamp(simulation.blockchain.get_curr_block_timestamp()) + timedelta(seconds=60)
+    max_amount_in = expand_to_18_decimals('10000000000')
     print("Last timestamp:", last_timestamp)
     for i in range(720):
-        low = 0
-        high = expand_to_18_decimals('10000000000')
-        blockchain.update(last_timestamp.timestamp() + 15) # ???
+        simulation.blockchain.update(last_timestamp.timestamp() + 15) # ???
 
-        while low <= high:
-            mid = (low + high) // 2
-
-            transaction = Transaction(last_timestamp, mid, X_NAME, Y_NAME, txd=uuid.uuid4())
-            transaction = SwapTransaction(transaction, DEFAULT_SLIPPAGE, amm._amm, transaction.txd)
-            transaction.block_timestamp = int(last_timestamp.timestamp()) + 15
-            SwapTransaction.instances = SwapTransaction.instances[:-1]
-
-            is_ok = (transaction.check_execute_status(transaction.block_timestamp) == TransactionStatus.SUCCESS)
-
-            if is_ok:
-                low = mid + 1
-                assert (transaction.check_execute_status(transaction.block_timestamp) == TransactionStatus.SUCCESS), 'Error'
-            else:
-                high = mid - 1
+        # the largest amount passing the checks in [0, max_amount_in], as found by bisecting with the swap checks of get_swap_quote
+        amount_in = simulation.amm.get_max_allowed_amount_in(X_NAME, int(last_timestamp.timestamp()) + 15, max_amount_in)
 
-        if low > expand_to_18_decimals('10000000000') or low-1==0:
+        if amount_in == max_amount_in or amount_in == 0:
             print("Unable to find amount in range, error")
 
             last_timestamp += timedelta(seconds=60)
             continue
 
-        transaction = Transaction(last_timestamp, low-1, X_NAME, Y_NAME, txd=uuid.uuid4())
-        amm.swap(transaction.txd, transaction, DEFAULT_SLIPPAGE)
+        transaction = Transaction(last_timestamp, amount_in, X_NAME, Y_NAME, txd=uuid.uuid4())
+        simulation.amm.swap(transaction.txd, transaction, DEFAULT_SLIPPAGE)
 
         last_timestamp += timedelta(seconds=60)
         
 
-def sequence_max_allowed_and_reverse():
-    sequence_max_allowed_strategy()
-    last_timestamp = datetime.fromtimestamp(blockchain.get_curr_block_timestamp()) + timedelta(seconds=60)
+def sequence_max_allowed_and_reverse(simulation):
+    sequence_max_allowed_strategy(simulation)
+    last_timestamp = datetime.fromtimestamp(simulation.blockchain.get_curr_block_timestamp()) + timedelta(seconds=60)
 
     for _ in range(50):
-        mx = 0
-        for i in range(35000):
-            amount_in = expand_to_18_decimals(i)
-            transaction = Transaction(last_timestamp, amount_in, Y_NAME, X_NAME, txd=uuid.uuid4())
-            transaction = SwapTransaction(transaction, DEFAULT_SLIPPAGE, amm._amm, transaction.txd)
-            transaction.block_timestamp = int(last_timestamp.timestamp()) + 15
-            SwapTransaction.instances = SwapTransaction.instances[:-1]
-            is_ok = (transaction.check_execute_status(transaction.block_timestamp) == TransactionStatus.SUCCESS)
-            if (is_ok):
-                mx = amount_in
+        # the largest whole amount of tokens below 35000 passing the checks
+        mx = simulation.amm.get_last_allowed_amount_in(Y_NAME, int(last_timestamp.timestamp()) + 15, expand_to_18_decimals(1), 35000)
 
         transaction = Transaction(last_timestamp, mx, Y_NAME, X_NAME, txd=uuid.uuid4())
-        amm.swap(transaction.txd, transaction, DEFAULT_SLIPPAGE)
+        simulation.amm.swap(transaction.txd, transaction, DEFAULT_SLIPPAGE)
 
-    blockchain.force_finish()
+    simulation.blockchain.force_finish()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -3,15 +3,13 @@ sys.path.insert(0, os.getcwd())
 
 import logging
 import pandas as pd
-import amm
 import os
 from datetime import datetime, timedelta
 from trading_simulation import MonteCarloTransactionSimulator, PoissonGenerator, Transaction, WeibullGenerator
-import blockchain
-from big_numbers import contract_18_decimals_to_float, expand_to_18_decimals
-from safe_math import q_decode_144
+from big_numbers import contract_decimals_to_float_array, expand_to_18_decimals_array
 import settings
 from transactions import SwapTransaction
+from simulation import Simulation
 
 # old main, required update (using main_historic_transactions.py)
 
@@ -66,7 +64,7 @@ def main():
     transactions1_df = pd.read_csv(transactions_history1_path)
     transactions2_df = pd.read_csv(transactions_history2_path)
     all_transactions = combine_transactions(transactions1_df, transactions2_df)
-    all_transactions['token_in_amount'] = all_transactions['token_in_amount'].apply(expand_to_18_decimals)
+    all_transactions['token_in_amount'] = expand_to_18_decimals_array(all_transactions['token_in_amount'])
     start_time = all_transactions['datetime_timestamp'].min()
 
 
@@ -74,70 +72,40 @@ def main():
         os.makedirs(f'{BASE_DIR}/{iteration}')
         #save_config(f'{BASE_DIR}/{iteration}/config.txt', OCCURENCES_PER_MIN, INITIAL_RESERVES_USD, INITIAL_SEC_PRICE, CAUCHY_SCALE_X, CAUCHY_SCALE_Y, CAUCHY_MAX_LIMIT_X, CAUCHY_MAX_LIMIT_Y, PRICE_TOLLERANCE_THRESHOLD, WINDOW_SIZE, GRANULARITY, vm)
 
-        amm.reset(X_NAME, Y_NAME, INITIAL_RESERVES_USD // INITIAL_SEC_PRICE , INITIAL_RESERVES_USD, vm, WINDOW_SIZE * 60 * 60, WINDOW_SIZE * 60 * 60// GRANULARITY, GRANULARITY) #todo: beautify
+        simulation = Simulation(X_NAME, Y_NAME, INITIAL_RESERVES_USD // INITIAL_SEC_PRICE , INITIAL_RESERVES_USD, vm, WINDOW_SIZE * 60 * 60, WINDOW_SIZE * 60 * 60// GRANULARITY, GRANULARITY) #todo: beautify
 
         cnt = 0
         for _, row in all_transactions.iterrows():
-            amm.reserve_X() / amm.reserve_Y()
+            simulation.amm.reserve_X / simulation.amm.reserve_Y
             
             if row['datetime_timestamp'] - start_time <= timedelta(days=1):
                 amount = row['token_in_amount'] // 1000 
             else:
                 amount = row['token_in_amount']
                 
-            amm.swap(cnt, Transaction(row['datetime_timestamp'], amount, row['token_in'], row['token_out']), DEFAULT_SLIPPAGE)
+            simulation.amm.swap(cnt, Transaction(row['datetime_timestamp'], amount, row['token_in'], row['token_out']), DEFAULT_SLIPPAGE)
             cnt += 1
 
-        SwapTransaction.save_all(f'{BASE_DIR}/{iteration}/swaps.csv')
-        blockchain.reset_state()
+        SwapTransaction.save_all(simulation.swap_transactions, f'{BASE_DIR}/{iteration}/swaps.csv', cols_to_normalize=['token_in_amount', 'token_out_amount', 'token_out_amount_min', 'system_fee', 'oracle_amount_out'])
 
-        amm.export_pool_states_to_csv(f'{BASE_DIR}/{iteration}/pool_before_transaction.csv', 
-                                        f'{BASE_DIR}/{iteration}/pool_after_transaction.csv')
+        simulation.amm.export_pool_states_to_csv(f'{BASE_DIR}/{iteration}/pool_before_transaction.csv', 
+                                        f'{BASE_DIR}/{iteration}/pool_after_transaction.csv', normalize=True)
 
-        logger.info("Start normalizing...")
-        normalize_csv(f'{BASE_DIR}/{iteration}/swaps.csv', ['token_in_amount', 'token_out_amount', 'token_out_amount_min', 'system_fee', 'oracle_amount_out'], f'{BASE_DIR}/{iteration}/swaps_normalized.csv')
-        normalize_pool_state(f'{BASE_DIR}/{iteration}/pool_before_transaction.csv', f'{BASE_DIR}/{iteration}/pool_before_transaction_normalized.csv')
-        normalize_pool_state(f'{BASE_DIR}/{iteration}/pool_after_transaction.csv', f'{BASE_DIR}/{iteration}/pool_after_transaction_normalized.csv')
-        logging.info("Finished normalizing")
 
         iteration += 1
 
-def normalize_csv(filename, cols_to_normalize, normalized_filename):
-    df = pd.read_csv(filename)
-
-    for col in cols_to_normalize:
-        df[col] = df[col].apply(contract_18_decimals_to_float)
-    
-    df.to_csv(normalized_filename, index=False)
-
 # todo: separate into func, cols - parameters
 def normalize_blockchain(blockchain_filename, normalized_filename):
-    blockchain_df = pd.read_csv(blockchain_filename)
+    cols_to_normalize = ['token_in_amount', 'token_out_amount', 'token_out_amount_min', 'system_fee', 'oracle_amount_out']
+    blockchain_df = pd.read_csv(blockchain_filename, dtype={col: str for col in cols_to_normalize})
 
-    # todo: deal with none
-    blockchain_df['token_in_amount'] = blockchain_df['token_in_amount'].apply(contract_18_decimals_to_float)
-    blockchain_df['token_out_amount'] = blockchain_df['token_out_amount'].apply(contract_18_decimals_to_float)
-    blockchain_df['token_out_amount_min'] = blockchain_df['token_out_amount_min'].apply(contract_18_decimals_to_float)
-    blockchain_df['system_fee'] = blockchain_df['system_fee'].apply(contract_18_decimals_to_float)
-    blockchain_df['oracle_amount_out'] = blockchain_df['oracle_amount_out'].apply(contract_18_decimals_to_float)
+    for col in cols_to_normalize:
+        blockchain_df[col] = contract_decimals_to_float_array(blockchain_df[col])
 
     blockchain_df.to_csv(normalized_filename)
 
 
 
-def normalize_pool_state(pool_state_filename, normalized_filename):
-    pool_state_df = pd.read_csv(pool_state_filename)
-
-    # todo: try optimizing
-    pool_state_df['reserve_X'] = pool_state_df['reserve_X'].apply(contract_18_decimals_to_float)
-    pool_state_df['reserve_Y'] = pool_state_df['reserve_Y'].apply(contract_18_decimals_to_float)
-    pool_state_df['k'] = pool_state_df['k'].apply(contract_18_decimals_to_float)
-    pool_state_df['k'] = pool_state_df['k'].apply(contract_18_decimals_to_float) # second time!!!
-    pool_state_df['price_X_cumulative'] = pool_state_df['price_X_cumulative'].apply(int).apply(q_decode_144)
-    pool_state_df['price_Y_cumulative'] = pool_state_df['price_Y_cumulative'].apply(int).apply(q_decode_144)
-
-    pool_state_df.to_csv(normalized_filename)
-
 def save_config(filename, mean_occurencies_per_min, initial_reserves_usd, ratios_sec_usd, cauchy_scale_x, cauchy_scale_y, cauchy_max_limit_x, cauchy_max_limit_y, price_tollerance_threshold, window_size, granularity, vm):
     with open(filename, 'w') as f:
         f.write("mean_occ_per_min: " + str(mean_occurencies_per_min))
@@ -169,9 +137,7 @@ def simulate_transactions(start_time, mean_occurencies_per_min, token0, token1,
     # simulation_seconds_total = int((total_number_transactions + 24*60*mean_occurencies_per_min) / mean_occurencies_per_min) 
     simulation_seconds_total = 60*24*50
 
-    for _ in range(simulation_seconds_total):
-        simulator.generate_transactions(current_iteration_timestamp)
-        current_iteration_timestamp += timedelta(milliseconds=simulator.frequency_generator.cycle_size)
+    current_iteration_timestamp = simulator.generate_cycles_transactions(current_iteration_timestamp, simulation_seconds_total)
 
     simulator.transaction_history_to_csv(transaction_history_filename)
 
@@ -5,17 +5,16 @@ import enum
 import logging
 from sre_constants import SUCCESS
 import pandas as pd
-import amm
 import json
 import os
 import numpy as np
 from datetime import date, datetime, timedelta
 from trading_simulation import MonteCarloTransactionSimulator, PoissonGenerator, Transaction, WeibullGenerator
-import blockchain
-from big_numbers import contract_18_decimals_to_float, expand_to_18_decimals
+from big_numbers import contract_18_decimals_to_float, expand_to_18_decimals_array
 from safe_math import q_decode_144
 from transactions import SwapTransaction, TransactionStatus
-from utils import normalize_csv, normalize_pool_state, save_dict
+from simulation import Simulation
+from utils import save_dict
 
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(name)s:%(message)s', datefmt="%m/%d/%Y %I:%M:%S %p")
@@ -86,7 +85,7 @@ def main():
             transactions1_df = pd.read_csv(transactions_history1_path)
             transactions2_df = pd.read_csv(transactions_history2_path)
             all_transactions = combine_transactions(transactions1_df, transactions2_df)
-            all_transactions['token_in_amount'] = all_transactions['token_in_amount'].apply(expand_to_18_decimals)
+            all_transactions['token_in_amount'] = expand_to_18_decimals_array(all_transactions['token_in_amount'])
             start_time = all_transactions['datetime_timestamp'].min()
             
             for subindex, vm in enumerate([(False, VMRejectionAlertBehaviour.NONE), (True, VMRejectionAlertBehaviour.NONE),
@@ -108,7 +107,7 @@ def main():
                 
                 
                 save_dict(f'{BASE_DIR}/{iteration}/{subindex}/config.txt', config)
-                amm.reset(X_NAME, Y_NAME, initial_reserves_usd // INITIAL_SEC_PRICE , initial_reserves_usd, vm_mode, WINDOW_SIZE * 60 * 60, WINDOW_SIZE * 60 * 60// GRANULARITY, GRANULARITY) #todo: beautify
+                simulation = Simulation(X_NAME, Y_NAME, initial_reserves_usd // INITIAL_SEC_PRICE , initial_reserves_usd, vm_mode, WINDOW_SIZE * 60 * 60, WINDOW_SIZE * 60 * 60// GRANULARITY, GRANULARITY) #todo: beautify
 
                 cnt = 0
                 swap_decrease_factor_numerator = 3
@@ -117,7 +116,7 @@ def main():
                 swap_timestamp_shift = timedelta(seconds=0)
 
                 for _, row in all_transactions.iterrows():
-                    amm.reserve_X() / amm.reserve_Y()
+                    simulation.amm.reserve_X / simulation.amm.reserve_Y
                     
                     if row['datetime_timestamp'] - start_time <= timedelta(days=1):
                         amount = row['token_in_amount'] // 1000 
@@ -125,15 +124,15 @@ def main():
                         amount = row['token_in_amount']
 
                     if vm == False or rejection_risk_action == VMRejectionAlertBehaviour.NONE:
-                        amm.swap(cnt, Transaction(row['datetime_timestamp'], amount, row['token_in'], row['token_out']), DEFAULT_SLIPPAGE)
+                        simulation.amm.swap(cnt, Transaction(row['datetime_timestamp'], amount, row['token_in'], row['token_out']), DEFAULT_SLIPPAGE)
                         cnt += 1
 
                     elif rejection_risk_action == VMRejectionAlertBehaviour.SINGLE_SMALLER_ALLOWED_SWAP:
                         desired_swap_amount = amount
 
                         for attempt in range(0, 6):
-                            if attempt == 5 or amm.verify_swap(cnt, Transaction(row['datetime_timestamp'], amount, row['token_in'], row['token_out']), DEFAULT_SLIPPAGE) == TransactionStatus.SUCCESS:
-                                amm.swap(cnt, Transaction(row['datetime_timestamp'], amount, row['token_in'], row['token_out'],
+                            if attempt == 5 or simulation.amm.verify_swap(cnt, Transaction(row['datetime_timestamp'], amount, row['token_in'], row['token_out']), DEFAULT_SLIPPAGE) == TransactionStatus.SUCCESS:
+                                simulation.amm.swap(cnt, Transaction(row['datetime_timestamp'], amount, row['token_in'], row['token_out'],
                                                     sequence_swap_cnt=0, desired_token_in_amount=desired_swap_amount, attempt_cnt=attempt), DEFAULT_SLIPPAGE)
 
                                 cnt += 1
@@ -153,8 +152,8 @@ def main():
                             if swapped_amount >= desired_swap_amount or curr_swaps >= max_swaps:
                                 break
                                 
-                            if attempt == max_tries - 1 or amm.verify_swap(cnt, Transaction(row['datetime_timestamp']+swap_timestamp_shift, amount, row['token_in'], row['token_out']), DEFAULT_SLIPPAGE) == TransactionStatus.SUCCESS:
-                                amm.swap(cnt, Transaction(row['datetime_timestamp']+swap_timestamp_shift, amount, row['token_in'], row['token_out'], 
+                            if attempt == max_tries - 1 or simulation.amm.verify_swap(cnt, Transaction(row['datetime_timestamp']+swap_timestamp_shift, amount, row['token_in'], row['token_out']), DEFAULT_SLIPPAGE) == TransactionStatus.SUCCESS:
+                                simulation.amm.swap(cnt, Transaction(row['datetime_timestamp']+swap_timestamp_shift, amount, row['token_in'], row['token_out'], 
                                                     sequence_swap_cnt=curr_swaps, desired_token_in_amount=desired_swap_amount, attempt_cnt=attempt), DEFAULT_SLIPPAGE)
                                 
                                 if swapped_amount < desired_swap_amount and curr_swaps + 1< max_swaps:
@@ -169,17 +168,11 @@ def main():
                                 amount = min(amount * swap_decrease_factor_numerator // swap_decrease_factor_denominator, desired_swap_amount - swapped_amount)
 
 
-                SwapTransaction.save_all(f'{BASE_DIR}/{iteration}/{subindex}/swaps.csv')
-                blockchain.reset_state()
+                SwapTransaction.save_all(simulation.swap_transactions, f'{BASE_DIR}/{iteration}/{subindex}/swaps.csv', cols_to_normalize=['token_in_amount', 'token_out_amount', 'token_out_amount_min', 'system_fee', 'oracle_amount_out', 'oracle_price', 'desired_token_in_amount'])
 
-                amm.export_pool_states_to_csv(f'{BASE_DIR}/{iteration}/{subindex}/pool_before_transaction.csv', 
-                                                f'{BASE_DIR}/{iteration}/{subindex}/pool_after_transaction.csv')
+                simulation.amm.export_pool_states_to_csv(f'{BASE_DIR}/{iteration}/{subindex}/pool_before_transaction.csv', 
+                                                f'{BASE_DIR}/{iteration}/{subindex}/pool_after_transaction.csv', normalize=True)
 
-                logger.info("Start normalizing...")
-                normalize_csv(f'{BASE_DIR}/{iteration}/{subindex}/swaps.csv', ['token_in_amount', 'token_out_amount', 'token_out_amount_min', 'system_fee', 'oracle_amount_out', 'oracle_price', 'desired_token_in_amount'], f'{BASE_DIR}/{iteration}/{subindex}/swaps_normalized.csv')
-                normalize_pool_state(f'{BASE_DIR}/{iteration}/{subindex}/pool_before_transaction.csv', f'{BASE_DIR}/{iteration}/{subindex}/pool_before_transaction_normalized.csv')
-                normalize_pool_state(f'{BASE_DIR}/{iteration}/{subindex}/pool_after_transaction.csv', f'{BASE_DIR}/{iteration}/{subindex}/pool_after_transaction_normalized.csv')
-                logger.info("Finished normalizing")
 
             iteration += 1
 
@@ -5,18 +5,16 @@ from datetime import datetime, timedelta
 import pandas as pd
 import enum
 import logging
-import scipy
+import numpy as np
 import json
 import os
 
 from main.main_dynamic_run import get_transactions
 from trading_simulation import MonteCarloTransactionSimulator, PoissonGenerator, Transaction, WeibullGenerator
-from big_numbers import expand_to_18_decimals
 from transactions import SwapTransaction, TransactionStatus
-from utils import normalize_csv, normalize_pool_state, save_dict
+from simulation import Simulation
+from utils import save_dict
 
-import blockchain
-import amm
 
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(name)s:%(message)s', datefmt="%m/%d/%Y %I:%M:%S %p")
@@ -85,6 +83,9 @@ def main():
         for p, p_params in enumerate(zip(params['shape'], params['scale'])):
             shape, scale = p_params
             os.makedirs(f'{BASE_DIR}/{iteration}')
+
+            # the amounts of the transactions don't depend on the variant, they are computed once for all of them
+            amounts = get_amounts(transactions[p], start_time, shape, scale)
             # transactions_history1_path = f'{BASE_DIR}/{iteration}/history1.csv'
             # transactions_history2_path = f'{BASE_DIR}/{iteration}/history2.csv'
 
@@ -116,7 +117,7 @@ def main():
                 
                 
                 save_dict(f'{BASE_DIR}/{iteration}/{subindex}/config.txt', config)
-                amm.reset(X_NAME, Y_NAME, initial_reserves_usd // INITIAL_SEC_PRICE , initial_reserves_usd, vm_mode, WINDOW_SIZE * 60 * 60, WINDOW_SIZE * 60 * 60 // GRANULARITY, GRANULARITY) #todo: beautify
+                simulation = Simulation(X_NAME, Y_NAME, initial_reserves_usd // INITIAL_SEC_PRICE , initial_reserves_usd, vm_mode, WINDOW_SIZE * 60 * 60, WINDOW_SIZE * 60 * 60 // GRANULARITY, GRANULARITY) #todo: beautify
 
                 cnt = 0
                 swap_decrease_factor_numerator = 3
@@ -124,32 +125,24 @@ def main():
 
                 swap_timestamp_shift = timedelta(seconds=0)
 
-                for transaction in transactions[p]:
+                for transaction, amount in zip(transactions[p], amounts):
                     datetime_timestamp, cummulative_freq, token_in, token_out = transaction
 
-                    token_in_amount = scipy.stats.weibull_min.ppf(cummulative_freq, shape, loc=0, scale=scale)## c freq
-                    token_in_amount = expand_to_18_decimals(token_in_amount)
-
-                    if datetime_timestamp - start_time <= timedelta(days=1):
-                        amount = token_in_amount // 1000 
-                    else:
-                        amount = token_in_amount
-
                     if vm == False or rejection_risk_action == VMRejectionAlertBehaviour.NONE:
-                        amm.swap(cnt, Transaction(datetime_timestamp, amount, token_in, token_out), DEFAULT_SLIPPAGE)
+                        simulation.amm.swap(cnt, Transaction(datetime_timestamp, amount, token_in, token_out), DEFAULT_SLIPPAGE)
                         cnt += 1
 
                     elif rejection_risk_action == VMRejectionAlertBehaviour.SINGLE_SMALLER_ALLOWED_SWAP:
                         desired_swap_amount = amount
 
-                        for attempt in range(0, 6):
-                            if attempt == 5 or amm.verify_swap(cnt, Transaction(datetime_timestamp, amount, token_in, token_out), DEFAULT_SLIPPAGE) == TransactionStatus.SUCCESS:
-                                amm.swap(cnt, Transaction(datetime_timestamp, amount, token_in, token_out,
-                                                    sequence_swap_cnt=0, desired_token_in_amount=desired_swap_amount, attempt_cnt=attempt), DEFAULT_SLIPPAGE)
+                        # the amounts of the 6 attempts are verified at once, the last one is sent anyway
+                        amounts = get_decreasing_amounts(amount, 6, swap_decrease_factor_numerator, swap_decrease_factor_denominator)
+                        statuses, _ = simulation.amm.verify_swap_amounts(Transaction(datetime_timestamp, amount, token_in, token_out), amounts[:-1])
+                        attempt = get_first_success_index(statuses)
 
-                                cnt += 1
-                                break
-                            amount = amount * swap_decrease_factor_numerator // swap_decrease_factor_denominator
+                        simulation.amm.swap(cnt, Transaction(datetime_timestamp, amounts[attempt], token_in, token_out,
+                                            sequence_swap_cnt=0, desired_token_in_amount=desired_swap_amount, attempt_cnt=attempt), DEFAULT_SLIPPAGE)
+                        cnt += 1
 
 
                     elif rejection_risk_action == VMRejectionAlertBehaviour.SEQUENCE_SMALLER_ALLOWED_SWAPS:
@@ -159,42 +152,73 @@ def main():
                         max_swaps = 5
                         max_tries = 10
                         curr_swaps = 0
+                        attempt = 0
+
+                        while attempt < max_tries and swapped_amount < desired_swap_amount and curr_swaps < max_swaps:
+                            # the amounts of the attempts left, up to the next swap, are verified at once (the last attempt is sent anyway)
+                            amounts = get_decreasing_amounts(amount, max_tries - attempt, swap_decrease_factor_numerator, swap_decrease_factor_denominator,
+                                                             desired_swap_amount - swapped_amount)
+                            statuses = []
 
-                        for attempt in range(0, max_tries):
-                            if swapped_amount >= desired_swap_amount or curr_swaps >= max_swaps:
-                                break
-                                
-                            if attempt == max_tries - 1 or amm.verify_swap(cnt, Transaction(datetime_timestamp+swap_timestamp_shift, amount, token_in, token_out), DEFAULT_SLIPPAGE) == TransactionStatus.SUCCESS:
-                                amm.swap(cnt, Transaction(datetime_timestamp, amount, token_in, token_out,
-                                                    sequence_swap_cnt=0, desired_token_in_amount=desired_swap_amount, attempt_cnt=attempt), DEFAULT_SLIPPAGE)
+                            if len(amounts) > 1:
+                                statuses, _ = simulation.amm.verify_swap_amounts(Transaction(datetime_timestamp+swap_timestamp_shift, amount, token_in, token_out), amounts[:-1])
 
-                                if swapped_amount < desired_swap_amount and curr_swaps + 1< max_swaps:
-                                    swap_timestamp_shift += timedelta(seconds=16)
+                            index = get_first_success_index(statuses)
+                            attempt += index
+                            amount = amounts[index]
 
-                                swapped_amount += amount
-                                curr_swaps += 1
-                                cnt += 1
+                            simulation.amm.swap(cnt, Transaction(datetime_timestamp, amount, token_in, token_out,
+                                                sequence_swap_cnt=0, desired_token_in_amount=desired_swap_amount, attempt_cnt=attempt), DEFAULT_SLIPPAGE)
 
-                                amount = min(amount, desired_swap_amount - swapped_amount)
-                            else:
-                                amount = min(amount * swap_decrease_factor_numerator // swap_decrease_factor_denominator, desired_swap_amount - swapped_amount)
+                            if swapped_amount < desired_swap_amount and curr_swaps + 1< max_swaps:
+                                swap_timestamp_shift += timedelta(seconds=16)
 
+                            swapped_amount += amount
+                            curr_swaps += 1
+                            cnt += 1
+                            attempt += 1
 
-                SwapTransaction.save_all(f'{BASE_DIR}/{iteration}/{subindex}/swaps.csv')
-                blockchain.reset_state()
+                            amount = min(amount, desired_swap_amount - swapped_amount)
 
-                amm.export_pool_states_to_csv(f'{BASE_DIR}/{iteration}/{subindex}/pool_before_transaction.csv', 
-                                                f'{BASE_DIR}/{iteration}/{subindex}/pool_after_transaction.csv')
 
-                logger.info("Start normalizing...")
-                normalize_csv(f'{BASE_DIR}/{iteration}/{subindex}/swaps.csv', ['token_in_amount', 'token_out_amount', 'token_out_amount_min', 'system_fee', 'oracle_amount_out', 'oracle_price', 'desired_token_in_amount'], f'{BASE_DIR}/{iteration}/{subindex}/swaps_normalized.csv')
-                normalize_pool_state(f'{BASE_DIR}/{iteration}/{subindex}/pool_before_transaction.csv', f'{BASE_DIR}/{iteration}/{subindex}/pool_before_transaction_normalized.csv')
-                normalize_pool_state(f'{BASE_DIR}/{iteration}/{subindex}/pool_after_transaction.csv', f'{BASE_DIR}/{iteration}/{subindex}/pool_after_transaction_normalized.csv')
-                logger.info("Finished normalizing")
+                SwapTransaction.save_all(simulation.swap_transactions, f'{BASE_DIR}/{iteration}/{subindex}/swaps.csv', cols_to_normalize=['token_in_amount', 'token_out_amount', 'token_out_amount_min', 'system_fee', 'oracle_amount_out', 'oracle_price', 'desired_token_in_amount'])
+
+                simulation.amm.export_pool_states_to_csv(f'{BASE_DIR}/{iteration}/{subindex}/pool_before_transaction.csv', 
+                                                f'{BASE_DIR}/{iteration}/{subindex}/pool_after_transaction.csv', normalize=True)
+
 
             iteration += 1
 
 
+# amounts of the swaps (divided by 1000 during the first day)
+def get_amounts(transactions, start_time, shape, scale):
+    amounts = WeibullGenerator(shape, 0, scale).get_amounts([transaction[1] for transaction in transactions])
+    warm_up = np.array([datetime_timestamp - start_time <= timedelta(days=1) for datetime_timestamp, *_ in transactions], dtype=bool)
+    amounts[warm_up] //= 1000
+
+    return amounts
+
+
+# amount and its count - 1 next decreases by numerator / denominator, each at most max_amount
+def get_decreasing_amounts(amount, count, numerator, denominator, max_amount=None):
+    amounts = [amount]
+
+    for _ in range(count - 1):
+        amount = amount * numerator // denominator
+
+        if max_amount is not None:
+            amount = min(amount, max_amount)
+
+        amounts.append(amount)
+
+    return amounts
+
+
+# index of the first successful status (len(statuses) if none is)
+def get_first_success_index(statuses):
+    return next((i for i, status in enumerate(statuses) if status == TransactionStatus.SUCCESS), len(statuses))
+
+
 def sim_transactions(start_time):
     X_cummulative_frequencies, X_timestamps = get_transactions(start_time, 24*25, 2)
     Y_cummulative_frequencies, Y_timestamps = get_transactions(start_time, 24*25, 2)
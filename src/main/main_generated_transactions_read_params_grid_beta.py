@@ -7,12 +7,11 @@ import json
 import os
 from datetime import datetime, timedelta
 
-import amm
-import blockchain
 from trading_simulation import MonteCarloTransactionSimulator, PoissonGenerator, Transaction, WeibullGenerator
-from big_numbers import expand_to_18_decimals
+from big_numbers import expand_to_18_decimals_array
 from transactions import SwapTransaction
-from utils import normalize_csv, normalize_pool_state, save_dict
+from simulation import Simulation
+from utils import save_dict
 
 # old main, required update (using main_historic_transactions.py)
 
@@ -80,7 +79,7 @@ def main():
                     transactions1_df = pd.read_csv(transactions_history1_path)
                     transactions2_df = pd.read_csv(transactions_history2_path)
                     all_transactions = combine_transactions(transactions1_df, transactions2_df)
-                    all_transactions['token_in_amount'] = all_transactions['token_in_amount'].apply(expand_to_18_decimals)
+                    all_transactions['token_in_amount'] = expand_to_18_decimals_array(all_transactions['token_in_amount'])
                     start_time = all_transactions['datetime_timestamp'].min()
                     
                     for subindex, vm in enumerate([False, True]):
@@ -97,31 +96,25 @@ def main():
                         }
                         
                         save_dict(f'{BASE_DIR}/{iteration}/{subindex}/config.json', config)
-                        amm.reset(X_NAME, Y_NAME, initial_reserves_usd // INITIAL_SEC_PRICE , initial_reserves_usd, vm, WINDOW_SIZE * 60 * 60, WINDOW_SIZE * 60 * 60// GRANULARITY, GRANULARITY) #todo: beautify
+                        simulation = Simulation(X_NAME, Y_NAME, initial_reserves_usd // INITIAL_SEC_PRICE , initial_reserves_usd, vm, WINDOW_SIZE * 60 * 60, WINDOW_SIZE * 60 * 60// GRANULARITY, GRANULARITY) #todo: beautify
 
                         cnt = 0
                         for _, row in all_transactions.iterrows():
-                            amm.reserve_X() / amm.reserve_Y()
+                            simulation.amm.reserve_X / simulation.amm.reserve_Y
                             
                             if row['datetime_timestamp'] - start_time <= timedelta(days=1):
                                 amount = row['token_in_amount'] // 1000 
                             else:
                                 amount = row['token_in_amount']
                                 
-                            amm.swap(cnt, Transaction(row['datetime_timestamp'], amount, row['token_in'], row['token_out'], slippage,))
+                            simulation.amm.swap(cnt, Transaction(row['datetime_timestamp'], amount, row['token_in'], row['token_out'], slippage,))
                             cnt += 1
 
-                        SwapTransaction.save_all(f'{BASE_DIR}/{iteration}/{subindex}/swaps.csv')
-                        blockchain.reset_state()
+                        SwapTransaction.save_all(simulation.swap_transactions, f'{BASE_DIR}/{iteration}/{subindex}/swaps.csv', cols_to_normalize=['token_in_amount', 'token_out_amount', 'token_out_amount_min', 'system_fee', 'oracle_amount_out', 'oracle_price'])
 
-                        amm.export_pool_states_to_csv(f'{BASE_DIR}/{iteration}/{subindex}/pool_before_transaction.csv', 
-                                                        f'{BASE_DIR}/{iteration}/{subindex}/pool_after_transaction.csv')
+                        simulation.amm.export_pool_states_to_csv(f'{BASE_DIR}/{iteration}/{subindex}/pool_before_transaction.csv', 
+                                                        f'{BASE_DIR}/{iteration}/{subindex}/pool_after_transaction.csv', normalize=True)
 
-                        logger.info("Start normalizing...")
-                        normalize_csv(f'{BASE_DIR}/{iteration}/{subindex}/swaps.csv', ['token_in_amount', 'token_out_amount', 'token_out_amount_min', 'system_fee', 'oracle_amount_out', 'oracle_price'], f'{BASE_DIR}/{iteration}/{subindex}/swaps_normalized.csv')
-                        normalize_pool_state(f'{BASE_DIR}/{iteration}/{subindex}/pool_before_transaction.csv', f'{BASE_DIR}/{iteration}/{subindex}/pool_before_transaction_normalized.csv')
-                        normalize_pool_state(f'{BASE_DIR}/{iteration}/{subindex}/pool_after_transaction.csv', f'{BASE_DIR}/{iteration}/{subindex}/pool_after_transaction_normalized.csv')
-                        logger.info("Finished normalizing")
 
                     iteration += 1
 
@@ -157,18 +150,14 @@ def simulate_transactions(start_time, mean_occurencies_per_min, token0, token1,
     simulator.frequency_generator.mean_occurencies = 1/15
     simulation_seconds_total = 60*24
 
-    for _ in range(simulation_seconds_total):
-        simulator.generate_transactions(current_iteration_timestamp)
-        current_iteration_timestamp += timedelta(milliseconds=simulator.frequency_generator.cycle_size)
+    current_iteration_timestamp = simulator.generate_cycles_transactions(current_iteration_timestamp, simulation_seconds_total)
 
     total_number_transactions = 3000
     simulator.frequency_generator.mean_occurencies = mean_occurencies_per_min
     simulation_cycles = int((total_number_transactions) / mean_occurencies_per_min) 
     print(simulation_cycles)
 
-    for _ in range(simulation_cycles):
-        simulator.generate_transactions(current_iteration_timestamp)
-        current_iteration_timestamp += timedelta(milliseconds=simulator.frequency_generator.cycle_size)
+    current_iteration_timestamp = simulator.generate_cycles_transactions(current_iteration_timestamp, simulation_cycles)
 
     simulator.transaction_history_to_csv(transaction_history_filename)
 
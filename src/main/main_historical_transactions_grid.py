@@ -2,17 +2,16 @@ import os, sys
 sys.path.insert(0, os.getcwd()) 
 
 
-from big_numbers import contract_18_decimals_to_float, expand_to_18_decimals_object
-from safe_math import q_decode_144
-from trading_simulation import Transaction #2?
+from pair_history import load_replay_events
+from replay_events import feed_events
 from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import itertools
 import logging
 import pandas as pd
-import amm
 import os
-import blockchain
-from transactions import BurnTransaction, MintTransaction, SwapTransaction
+from multi_oracle_simulation import MultiOracleSimulation
+from transactions import TransactionType
 
 # GRID_RUN SIMULATIONS WITH VOLATILITY MITIGATOR BASED PARAMS in 2 modes (enabled/disabled VIM)
 
@@ -25,36 +24,15 @@ Y_NAME = 'WETH'
 X_INDEX = '0'
 Y_INDEX = '1'
 
-def main(): 
-    swaps_path = f'../data/pair_history/{X_NAME}_{Y_NAME}/{X_NAME.lower()}_{Y_NAME.lower()}_swaps.pkl'
-    mints_path = f'../data/pair_history/{X_NAME}_{Y_NAME}/{X_NAME.lower()}_{Y_NAME.lower()}_mints.pkl'
-    burns_path = f'../data/pair_history/{X_NAME}_{Y_NAME}/{X_NAME.lower()}_{Y_NAME.lower()}_burns.pkl'
-
-    swaps_df = pd.read_pickle(swaps_path)
-    mints_df = pd.read_pickle(mints_path)
-    burns_df = pd.read_pickle(burns_path)
-
-    swaps_df['type'] = 'SWAP'
-    mints_df['type'] = 'MINT'
-    burns_df['type'] = 'BURN'
-
-    burns_df = burns_df[~burns_df.isnull().any(axis=1)] # todo: print number of missing
-
-    swaps_df, mints_df, burns_df = expand_all_transactions_history(swaps_df, mints_df, burns_df)
-    transactions_df = pd.concat([swaps_df, mints_df, burns_df])
-
-    transactions_df.sort_values('timestamp', inplace=True)
+MAX_WORKERS = os.cpu_count()
+# cells with the volatility mitigator on replayed together by one MultiOracleSimulation: the shared prefix of the history
+# is replayed once for all of them, but the forked branches replay the rest of it one after another in the same worker
+MAX_REPLAY_CELLS = 3
 
+def main(): 
     base_experiment_path = f'../data/real_transactions_grid/experiment_{EXPERIMENT_ID}'
     os.makedirs(base_experiment_path)
 
-
-
-
-    iteration = 0
-    window_size = 48
-    granularity = 24
-
     window_size_list = [24]
     period_list = [0.5, 1, 2, 3, 6, 12]
 
@@ -62,13 +40,32 @@ def main():
         f.write('window_size_list: ' + str(window_size_list))
         f.write('\nperiod_list: ' + str(period_list))
 
-    grid = itertools.product(window_size_list, period_list)
-
+    cells = get_grid_cells(window_size_list, period_list)
     iterations_info_df = pd.DataFrame(columns=['iteration_id', 'window_size', 'granularity', 'period'])
 
+    # the transactions history is compiled into the pair history cache once here, the workers map it from there
+    # and reuse it for all of their replays
+    events, missing_burns = load_replay_events(X_NAME, Y_NAME, X_INDEX, Y_INDEX, sender_column='txd')
+    print('Missing burns: ', missing_burns)
+
+    with ProcessPoolExecutor(max_workers=MAX_WORKERS, initializer=init_worker) as executor:
+        futures = {executor.submit(run_cells, base_experiment_path, replay_cells): replay_cells for replay_cells in get_replays(cells, MAX_REPLAY_CELLS)}
+
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            future.result()
+
+            for iteration, window_size, period_size, granularity, vm in futures[future]:
+                iterations_info_df.loc[iteration] = [iteration, window_size, granularity, period_size]
+
+            save_atomically(iterations_info_df.sort_index(), f'{base_experiment_path}/iterations_info.csv')
+
+
+def get_grid_cells(window_size_list, period_list):
+    cells = []
+    iteration = 0
     run_without_vm = False
 
-    for window_size, period_size in grid:
+    for window_size, period_size in itertools.product(window_size_list, period_list):
         granularity = round(window_size / period_size)
 
         for vm in [False, True]:
@@ -78,84 +75,73 @@ def main():
                 else:
                     run_without_vm = True
 
-            os.makedirs(f'{base_experiment_path}/{iteration}')
-            save_config(f'{base_experiment_path}/{iteration}/config.txt', window_size, granularity, vm)
+            cells.append((iteration, window_size, period_size, granularity, vm))
+            iteration += 1
 
-            amm.reset(X_NAME, Y_NAME, int(0), int(0), vm, window_size * 60 * 60, round(period_size * 60 * 60) , granularity) #todo: beautify
-            iterations_info_df.loc[iteration] = [iteration, window_size, granularity, period_size]
+    return cells
 
-            cnt = 0 
-            
-            for index, row in tqdm(transactions_df.iterrows()):
-                blockchain.update(row['timestamp'].second)
 
-                if row['type'] == 'SWAP':
-                    amm.swap(cnt, Transaction(row['timestamp'], int(row['amount_in']), row['token_in'], row['token_out'], 100, row['txd']), 100)
-                elif row['type'] == 'MINT':
-                    amm.mint(int(row[f'amount{X_INDEX}']), int(row[f'amount{Y_INDEX}']), row['timestamp'], cnt)
-                elif row['type'] == 'BURN':
-                    amm.burn(int(row[f'amount{X_INDEX}']), int(row[f'amount{Y_INDEX}']), row['timestamp'], cnt)
+def init_worker():
+    global _events
 
-                cnt += 1
+    # the swaps' txd column is written as their sender, as the replay always did
+    _events, missing_burns = load_replay_events(X_NAME, Y_NAME, X_INDEX, Y_INDEX, sender_column='txd')
 
 
-            SwapTransaction.save_all(f'{base_experiment_path}/{iteration}/swaps.csv')
-            MintTransaction.save_all(f'{base_experiment_path}/{iteration}/mints.csv')
-            BurnTransaction.save_all(f'{base_experiment_path}/{iteration}/burns.csv')
-            blockchain.reset_state()
-            
-            amm.export_pool_states_to_csv(f'{base_experiment_path}/{iteration}/pool_before_transaction.csv', 
-                                            f'{base_experiment_path}/{iteration}/pool_after_transaction.csv')
+# the cells with the volatility mitigator on of the same window size are replayed together (see MultiOracleSimulation), the ones without it
+# get a replay of their own. A group is split into replays of at most max_replay_cells cells (see MAX_REPLAY_CELLS)
+def get_replays(cells, max_replay_cells):
+    groups = {}
 
-            logger.info("Start normalizing...")
-            normalize_csv(f'{base_experiment_path}/{iteration}/swaps.csv', ['token_in_amount', 'token_out_amount', 'token_out_amount_min', 'system_fee', 'oracle_amount_out'], f'{base_experiment_path}/{iteration}/swaps_normalized.csv')
-            normalize_csv(f'{base_experiment_path}/{iteration}/mints.csv', ['X_amount', 'Y_amount'], f'{base_experiment_path}/{iteration}/mints_normalized.csv')
-            normalize_csv(f'{base_experiment_path}/{iteration}/burns.csv', ['X_amount', 'Y_amount'], f'{base_experiment_path}/{iteration}/burns_normalized.csv')
+    for cell in cells:
+        iteration, window_size, period_size, granularity, vm = cell
+        key = window_size if vm else f'no_vm_{iteration}'
 
-            normalize_pool_state(f'{base_experiment_path}/{iteration}/pool_before_transaction.csv', f'{base_experiment_path}/{iteration}/pool_before_transaction_normalized.csv')
-            normalize_pool_state(f'{base_experiment_path}/{iteration}/pool_after_transaction.csv', f'{base_experiment_path}/{iteration}/pool_after_transaction_normalized.csv')
-            logging.info("Finished normalizing")
+        groups.setdefault(key, []).append(cell)
+
+    return [group[i:i + max_replay_cells] for group in groups.values() for i in range(0, len(group), max_replay_cells)]
 
-            iteration += 1
 
-        iterations_info_df.to_csv(f'{base_experiment_path}/iterations_info.csv')
+def run_cells(base_experiment_path, cells):
+    events = _events
 
+    # outputs are written into temporary directories which are renamed once the replay is complete,
+    # so an interrupted grid never leaves a partially written iteration behind
+    tmp_iteration_paths = []
 
-def expand_all_transactions_history(swaps_df, mints_df, burns_df):
-    swaps_df['amount_in'] = swaps_df['amount_in'].apply(expand_to_18_decimals_object)
-    swaps_df['amount_out'] = swaps_df['amount_out'].apply(expand_to_18_decimals_object)
+    for iteration, window_size, period_size, granularity, vm in cells:
+        tmp_iteration_path = f'{base_experiment_path}/{iteration}.tmp'
+        os.makedirs(tmp_iteration_path)
+        save_config(f'{tmp_iteration_path}/config.txt', window_size, granularity, vm)
+        tmp_iteration_paths.append(tmp_iteration_path)
 
-    mints_df[f'amount{X_INDEX}'] = mints_df[f'amount{X_INDEX}'].apply(expand_to_18_decimals_object)
-    mints_df[f'amount{Y_INDEX}'] = mints_df[f'amount{Y_INDEX}'].apply(expand_to_18_decimals_object)
+    oracle_configs = [(window_size * 60 * 60, round(period_size * 60 * 60), granularity) for iteration, window_size, period_size, granularity, vm in cells] #todo: beautify
 
-    burns_df[f'amount{X_INDEX}'] = burns_df[f'amount{X_INDEX}'].apply(expand_to_18_decimals_object)
-    burns_df[f'amount{Y_INDEX}'] = burns_df[f'amount{Y_INDEX}'].apply(expand_to_18_decimals_object)
+    vm = cells[0][4]
+    replay = MultiOracleSimulation(X_NAME, Y_NAME, int(0), int(0), vm, oracle_configs)
 
-    return swaps_df, mints_df, burns_df
+    for index, tmp_iteration_path in enumerate(tmp_iteration_paths):
+        replay.stream_transactions(index, f'{tmp_iteration_path}/swaps.csv', f'{tmp_iteration_path}/mints.csv', f'{tmp_iteration_path}/burns.csv',
+                                   cols_to_normalize={TransactionType.SWAP: ['token_in_amount', 'token_out_amount', 'token_out_amount_min', 'system_fee', 'oracle_amount_out'], TransactionType.MINT: ['X_amount', 'Y_amount'], TransactionType.BURN: ['X_amount', 'Y_amount']})
 
+    feed_events(replay, events, 100)
 
+    replay.close_transaction_sinks()
 
-def normalize_csv(filename, cols_to_normalize, normalized_filename):
-    df = pd.read_csv(filename)
+    for index, (tmp_iteration_path, cell) in enumerate(zip(tmp_iteration_paths, cells)):
+        replay.get_simulation(index).amm.export_pool_states_to_csv(f'{tmp_iteration_path}/pool_before_transaction.csv', 
+                                        f'{tmp_iteration_path}/pool_after_transaction.csv', normalize=True, normalized_index=False)
 
-    for col in cols_to_normalize:
-        df[col] = df[col].apply(contract_18_decimals_to_float)
-    
-    df.to_csv(normalized_filename, index=False)
+        os.rename(tmp_iteration_path, f'{base_experiment_path}/{cell[0]}')
 
+    return [cell[0] for cell in cells]
 
-def normalize_pool_state(pool_state_filename, normalized_filename):
-    pool_state_df = pd.read_csv(pool_state_filename)
 
-    # todo: try optimizing
-    pool_state_df['reserve_X'] = pool_state_df['reserve_X'].apply(contract_18_decimals_to_float)
-    pool_state_df['reserve_Y'] = pool_state_df['reserve_Y'].apply(contract_18_decimals_to_float)
-    pool_state_df['k'] = pool_state_df['k'].apply(contract_18_decimals_to_float)
-    pool_state_df['k'] = pool_state_df['k'].apply(contract_18_decimals_to_float) # second time!!!
-    pool_state_df['price_X_cumulative'] = pool_state_df['price_X_cumulative'].apply(int).apply(q_decode_144)
-    pool_state_df['price_Y_cumulative'] = pool_state_df['price_Y_cumulative'].apply(int).apply(q_decode_144)
+def save_atomically(df, filename):
+    tmp_filename = f'{filename}.tmp'
+    df.to_csv(tmp_filename)
+    os.replace(tmp_filename, filename)
 
-    pool_state_df.to_csv(normalized_filename, index=False)
 
 def save_config(filename, window_size, granularity, vm):
     with open(filename, 'w') as f:
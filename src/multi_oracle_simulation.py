@@ -0,0 +1,176 @@
+from typing import Dict, List, Tuple
+
+from dsw_oracle import DSWOracle
+from settings import BLOCK_TIME, PRICE_TOLLERANCE_THRESHOLD
+from simulation import Simulation, create_transaction_sinks
+from transaction_sink import CHUNK_SIZE, OutputFormat, TransactionSink
+from transactions import TransactionType
+from volatility_mitigation import MitigatorCheckResult, VolatilityMitigator
+
+
+class OracleBranch:
+    """
+    DSW oracle configuration (window_size, period_size, granularity) evaluated on the pool of the trunk simulation.
+    As long as its mitigator decisions agree with the trunk's ones the pools don't differ, only the swaps rows
+    (mitigator check status and diagnostics) are written separately. At the first different decision the branch
+    is forked into its own simulation, which continues from the trunk's state at that point
+    """
+    def __init__(self, trunk: Simulation, window_size: int, period_size: int, granularity: int) -> None:
+        self.trunk = trunk
+        self.dsw_oracle = DSWOracle(trunk, window_size, granularity)
+        self.volatility_mitigator = VolatilityMitigator(trunk, PRICE_TOLLERANCE_THRESHOLD, self.dsw_oracle)
+        self.transaction_sinks: Dict[TransactionType, TransactionSink] = {}
+
+        self.checked_transaction = None
+        self.mitigator_check = None
+
+        self.simulation = None
+        self.resume_pending = False
+
+        assert self.dsw_oracle.period_size == period_size, "ERROR: GRANULARITY, PERIOD_SIZE MISMATCH"
+
+
+    def get_simulation(self) -> Simulation:
+        return self.trunk if self.simulation is None else self.simulation
+
+
+    # same check and oracle update as SwapTransaction.try_execute does with the trunk's oracle
+    def check(self, swap_transaction, amount_out, reserve_out_final, block_timestamp, block_transaction):
+        mitigator_check = MitigatorCheckResult()
+        branch_block_transaction = self.volatility_mitigator.mitigate(swap_transaction.token_in, swap_transaction.token_out, swap_transaction.token_in_amount,
+                                                                      amount_out, reserve_out_final, block_timestamp, mitigator_check)
+
+        if branch_block_transaction != block_transaction:
+            self.fork()
+            return
+
+        self.dsw_oracle.update(block_timestamp)
+        self.checked_transaction = swap_transaction
+        self.mitigator_check = mitigator_check
+
+
+    # the trunk is copied before the swap is applied (its pair already updated), the fork reverses the update and executes the swap again
+    # with the branch's oracle once the trunk has finished the current call (see MultiOracleSimulation.dispatch)
+    def fork(self):
+        self.trunk.oracle_branches.remove(self)
+        self.simulation = self.trunk.fork(self.dsw_oracle, self.transaction_sinks)
+        self.resume_pending = True
+
+        self.dsw_oracle = self.simulation.dsw_oracle
+        self.volatility_mitigator = None
+
+
+    def resume(self):
+        blockchain = self.simulation.blockchain
+        blockchain.block_transactions[blockchain.block_transaction_index].reset_mitigator_check()
+        self.simulation.amm.reverse_state()
+        blockchain.resume_block()
+        self.resume_pending = False
+
+
+    def finalize_transaction(self, transaction):
+        sink = self.transaction_sinks.get(transaction.type)
+
+        if sink is None:
+            return
+
+        if transaction.type == TransactionType.SWAP and transaction is self.checked_transaction:
+            sink.write_row(transaction.to_list(self.mitigator_check))
+        else:
+            sink.write(transaction)
+
+
+    def close_transaction_sinks(self):
+        if self.simulation is not None:
+            self.simulation.close_transaction_sinks()
+            return
+
+        for sink in self.transaction_sinks.values():
+            sink.close()
+
+        self.transaction_sinks = {}
+
+
+class MultiOracleSimulation:
+    """
+    Replays one transactions history for several DSW oracle configurations. The first configuration drives the trunk simulation, the others are oracle branches sharing its pool until
+    their first different mitigator decision, so a replay costs about as much as a single run plus the forked parts.
+    Drivers call update/swap/mint/burn (or the _at forms) here instead of on the blockchain and the AMM of a simulation
+    """
+    def __init__(self, X: str, Y: str, reserve0_X: int, reserve0_Y: int, is_volatility_mitigator_on: bool, oracle_configs: List[Tuple[int, int, int]],
+                 avg_block_time: int=BLOCK_TIME) -> None:
+        window_size, period_size, granularity = oracle_configs[0]
+
+        self.trunk = Simulation(X, Y, reserve0_X, reserve0_Y, is_volatility_mitigator_on, window_size, period_size, granularity, avg_block_time)
+        self.branches = [OracleBranch(self.trunk, *oracle_config) for oracle_config in oracle_configs[1:]]
+        self.trunk.oracle_branches = list(self.branches)
+
+
+    # simulation of the index-th oracle configuration, the trunk for the branches which haven't been forked
+    def get_simulation(self, index: int) -> Simulation:
+        if index == 0:
+            return self.trunk
+
+        return self.branches[index - 1].get_simulation()
+
+
+    def get_forks(self) -> List[Simulation]:
+        return [branch.simulation for branch in self.branches if branch.simulation is not None]
+
+
+    def stream_transactions(self, index: int, swaps_filename, mints_filename=None, burns_filename=None, chunk_size=CHUNK_SIZE, output_format=OutputFormat.CSV,
+                            cols_to_normalize: Dict[TransactionType, List[str]]=None):
+        if index == 0:
+            self.trunk.stream_transactions(swaps_filename, mints_filename, burns_filename, chunk_size, output_format, cols_to_normalize)
+        else:
+            self.branches[index - 1].transaction_sinks.update(create_transaction_sinks(swaps_filename, mints_filename, burns_filename, chunk_size,
+                                                                                       output_format, cols_to_normalize))
+
+
+    # runs a driver call on the trunk and on the forks. Branches forked during the call first finish the block
+    # which was interrupted by the fork, then they get the call as well
+    def dispatch(self, call):
+        for simulation in self.get_forks():
+            call(simulation)
+
+        call(self.trunk)
+
+        for branch in self.branches:
+            if branch.resume_pending:
+                branch.resume()
+                call(branch.simulation)
+
+
+    def update(self, next_transaction_timestamp: int):
+        self.dispatch(lambda simulation: simulation.blockchain.update(next_transaction_timestamp))
+
+
+    def swap(self, id, transaction, slippage):
+        self.dispatch(lambda simulation: simulation.amm.swap(id, transaction, slippage))
+
+
+    def mint(self, amount_X, amount_Y, timestamp, id):
+        self.dispatch(lambda simulation: simulation.amm.mint(amount_X, amount_Y, timestamp, id))
+
+
+    def burn(self, amount_X, amount_Y, timestamp, id):
+        self.dispatch(lambda simulation: simulation.amm.burn(amount_X, amount_Y, timestamp, id))
+
+
+    def swap_at(self, id, timestamp: int, token_in: str, token_out: str, token_in_amount: int, slippage, sender=None, to=None, desired_token_in_amount=None):
+        self.dispatch(lambda simulation: simulation.amm.swap_at(id, timestamp, token_in, token_out, token_in_amount, slippage, sender, to, desired_token_in_amount))
+
+
+    def mint_at(self, amount_X, amount_Y, timestamp: int, id):
+        self.dispatch(lambda simulation: simulation.amm.mint_at(amount_X, amount_Y, timestamp, id))
+
+
+    def burn_at(self, amount_X, amount_Y, timestamp: int, id):
+        self.dispatch(lambda simulation: simulation.amm.burn_at(amount_X, amount_Y, timestamp, id))
+
+
+    def close_transaction_sinks(self):
+        self.trunk.close_transaction_sinks()
+
+        for branch in self.branches:
+            branch.close_transaction_sinks()
@@ -0,0 +1,191 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+from typing import Dict, List, Tuple
+import numpy as np
+import pandas as pd
+from big_numbers import expand_to_18_decimals_array, ints_to_limbs, limbs_to_ints
+from replay_events import ReplayEvents, compile_columns
+
+logger = logging.getLogger(__name__)
+
+PAIR_HISTORY_DIR = '../data/pair_history'
+CACHE_DIR = '../data/pair_history/cache'
+# bump when the layout of the cached columns or the way they are built changes
+CACHE_VERSION = 1
+
+AMOUNT_COLUMNS = ['amount_in', 'amount_X', 'amount_Y']
+STRING_COLUMNS = ['txd', 'sender', 'to']
+
+
+def get_pair_history_paths(X_NAME: str, Y_NAME: str) -> List[str]:
+    return [f'{PAIR_HISTORY_DIR}/{X_NAME}_{Y_NAME}/{X_NAME.lower()}_{Y_NAME.lower()}_{name}.pkl' for name in ['swaps', 'mints', 'burns']]
+
+
+# swaps, mints and burns of the pair (burns with missing values dropped), with expanded amounts and sorted by timestamp.
+# Also returns the number of dropped burns
+def load_pair_history(X_NAME: str, Y_NAME: str, X_INDEX: str, Y_INDEX: str):
+    swaps_path, mints_path, burns_path = get_pair_history_paths(X_NAME, Y_NAME)
+
+    swaps_df = pd.read_pickle(swaps_path)
+    mints_df = pd.read_pickle(mints_path)
+    burns_df = pd.read_pickle(burns_path)
+
+    swaps_df['type'] = 'SWAP'
+    mints_df['type'] = 'MINT'
+    burns_df['type'] = 'BURN'
+
+    missing_burns = int(burns_df.isnull().any(axis=1).sum())
+    burns_df = burns_df[~burns_df.isnull().any(axis=1)]
+
+    swaps_df, mints_df, burns_df = expand_all_transactions_history(swaps_df, mints_df, burns_df, X_INDEX, Y_INDEX)
+    transactions_df = pd.concat([swaps_df, mints_df, burns_df])
+    transactions_df.sort_values('timestamp', inplace=True)
+
+    return transactions_df, missing_burns
+
+
+def expand_all_transactions_history(swaps_df, mints_df, burns_df, X_INDEX, Y_INDEX):
+    swaps_df['amount_in'] = expand_to_18_decimals_array(swaps_df['amount_in'])
+    swaps_df['amount_out'] = expand_to_18_decimals_array(swaps_df['amount_out'])
+
+    mints_df[f'amount{X_INDEX}'] = expand_to_18_decimals_array(mints_df[f'amount{X_INDEX}'])
+    mints_df[f'amount{Y_INDEX}'] = expand_to_18_decimals_array(mints_df[f'amount{Y_INDEX}'])
+
+    burns_df[f'amount{X_INDEX}'] = expand_to_18_decimals_array(burns_df[f'amount{X_INDEX}'])
+    burns_df[f'amount{Y_INDEX}'] = expand_to_18_decimals_array(burns_df[f'amount{Y_INDEX}'])
+
+    return swaps_df, mints_df, burns_df
+
+
+class PairHistoryCache:
+    """
+    Content addressed store of compiled pair histories (see replay_events.compile_columns). An entry is a directory named
+    after the hashes of the source pickles, with one .npy file per column: numeric columns are memory-mapped when loaded,
+    so parallel replays of the same pair share their pages, exact amounts are kept as uint64 limbs and strings as fixed width unicode.
+    Entries are written into a temporary directory and renamed, readers never see a partial entry
+    """
+    def __init__(self, cache_dir: str=CACHE_DIR) -> None:
+        self.cache_dir = cache_dir
+
+
+    def get_key(self, source_paths: List[str], X_INDEX: str, Y_INDEX: str) -> str:
+        key = hashlib.sha256(f'{CACHE_VERSION}:{X_INDEX}:{Y_INDEX}'.encode())
+
+        for path in source_paths:
+            key.update(get_file_hash(path).encode())
+
+        return key.hexdigest()
+
+
+    def load(self, key: str):
+        path = f'{self.cache_dir}/{key}'
+
+        if not os.path.isdir(path):
+            return None
+
+        with open(f'{path}/metadata.json') as f:
+            metadata = json.load(f)
+
+        columns = {}
+
+        for column in metadata['columns']:
+            if column in AMOUNT_COLUMNS:
+                columns[column] = from_limbs(np.load(f'{path}/{column}.npy', mmap_mode='r'), np.load(f'{path}/{column}_missing.npy', mmap_mode='r'))
+            elif column in STRING_COLUMNS:
+                columns[column] = from_strings(np.load(f'{path}/{column}.npy', mmap_mode='r'), np.load(f'{path}/{column}_missing.npy', mmap_mode='r'))
+            else:
+                columns[column] = np.load(f'{path}/{column}.npy', mmap_mode='r')
+
+        return metadata, columns
+
+
+    def save(self, key: str, metadata: Dict, columns: Dict[str, np.ndarray]):
+        path = f'{self.cache_dir}/{key}'
+        tmp_path = f'{path}.tmp{os.getpid()}'
+        os.makedirs(tmp_path)
+
+        for column, values in columns.items():
+            if column in AMOUNT_COLUMNS:
+                limbs, missing = to_limbs(values)
+                np.save(f'{tmp_path}/{column}.npy', limbs)
+                np.save(f'{tmp_path}/{column}_missing.npy', missing)
+            elif column in STRING_COLUMNS:
+                strings, missing = to_strings(values)
+                np.save(f'{tmp_path}/{column}.npy', strings)
+                np.save(f'{tmp_path}/{column}_missing.npy', missing)
+            else:
+                np.save(f'{tmp_path}/{column}.npy', values)
+
+        with open(f'{tmp_path}/metadata.json', 'w') as f:
+            json.dump(dict(metadata, columns=list(columns)), f)
+
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # written by another process in the meantime, both entries have the same content
+            logger.info(f'Pair history cache entry {key} already exists')
+            shutil.rmtree(tmp_path)
+
+
+# events of the pair history for replays, compiled once per content of the source pickles and then loaded from the cache.
+# The column arguments are as in ReplayEvents.from_dataframe (one of txd, sender, to). Also returns the number of dropped burns
+def load_replay_events(X_NAME: str, Y_NAME: str, X_INDEX: str, Y_INDEX: str, sender_column: str=None, to_column: str=None,
+                       desired_token_in_amount_column: str=None, cache: PairHistoryCache=None) -> Tuple[ReplayEvents, int]:
+    cache = cache or PairHistoryCache()
+    key = cache.get_key(get_pair_history_paths(X_NAME, Y_NAME), X_INDEX, Y_INDEX)
+    cached = cache.load(key)
+
+    if cached is None:
+        transactions_df, missing_burns = load_pair_history(X_NAME, Y_NAME, X_INDEX, Y_INDEX)
+        tokens, columns = compile_columns(transactions_df, X_INDEX, Y_INDEX, [column for column in STRING_COLUMNS if column in transactions_df])
+        cache.save(key, {'tokens': tokens, 'missing_burns': missing_burns}, columns)
+        cached = cache.load(key)
+
+    metadata, columns = cached
+    events = ReplayEvents.from_columns(metadata['tokens'], columns, sender_column, to_column, desired_token_in_amount_column)
+
+    return events, metadata['missing_burns']
+
+
+def get_file_hash(path: str) -> str:
+    file_hash = hashlib.sha256()
+
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            file_hash.update(block)
+
+    return file_hash.hexdigest()
+
+
+def to_limbs(values: np.ndarray):
+    missing = np.array([value is None for value in values], dtype=bool)
+    ints = [0 if value is None else value for value in values]
+
+    assert all(value >= 0 for value in ints), 'Cannot cache negative amounts'
+
+    limbs = max([-(-value.bit_length() // 64) for value in ints] + [1])
+
+    return ints_to_limbs(ints, limbs), missing
+
+
+def from_limbs(limbs: np.ndarray, missing: np.ndarray) -> np.ndarray:
+    values = limbs_to_ints(limbs)
+    values[missing] = None
+
+    return values
+
+
+def to_strings(values: np.ndarray):
+    missing = np.array([value is None for value in values], dtype=bool)
+
+    return np.array(['' if value is None else str(value) for value in values], dtype=str), missing
+
+
+def from_strings(strings: np.ndarray, missing: np.ndarray) -> np.ndarray:
+    values = strings.astype(object)
+    values[missing] = None
+
+    return values
@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+from big_numbers import contract_decimals_to_float_array, limbs_to_ints
+from safe_math import q_decode_144_limbs
+from arrow_tables import get_arrow_type, limbs_to_decimal_array, require_pyarrow
+
+LIMB_BYTES = 8
+LIMB_BITS = LIMB_BYTES * 8
+
+
+class BigIntColumn:
+    """
+    Growable column of non-negative integers of arbitrary size. Every value is stored in a fixed number
+    of little-endian uint64 limbs; the column is widened when a value doesn't fit anymore.
+    """
+    def __init__(self, capacity: int, limbs: int = 2):
+        self.capacity = capacity
+        self.limbs_count = limbs
+        self.buffer = bytearray(capacity * limbs * LIMB_BYTES)
+
+
+    def set(self, index: int, value: int):
+        width = self.limbs_count * LIMB_BYTES
+
+        try:
+            self.buffer[index * width:(index + 1) * width] = value.to_bytes(width, 'little')
+        except OverflowError:
+            assert value >= 0, f'Cannot record negative value {value}'
+
+            self.widen(-(-value.bit_length() // LIMB_BITS))
+            self.set(index, value)
+
+
+    def widen(self, limbs: int):
+        data = np.zeros((self.capacity, limbs), dtype='<u8')
+        data[:, :self.limbs_count] = self.limbs(self.capacity)
+
+        self.buffer = bytearray(data.tobytes())
+        self.limbs_count = limbs
+
+
+    def grow(self, capacity: int):
+        self.buffer.extend(bytes((capacity - self.capacity) * self.limbs_count * LIMB_BYTES))
+        self.capacity = capacity
+
+
+    def limbs(self, size: int) -> np.ndarray:
+        """
+        Zero-copy (size, limbs) uint64 view of the first size values, least significant limb first
+        (the column can't grow while the view is alive)
+        """
+        return np.frombuffer(self.buffer, dtype='<u8', count=size * self.limbs_count).reshape(size, self.limbs_count)
+
+
+    def to_object_array(self, size: int) -> np.ndarray:
+        """
+        Exact values of the first size records as python ints (object array)
+        """
+        return limbs_to_ints(self.limbs(size))
+
+
+class PoolStateRecorder:
+    """
+    Columnar storage of pool states, replacing the list of per-transaction python lists
+    """
+    COLUMNS = ['transaction_id', 'reserve_X', 'reserve_Y', 'k', 'price_X_cumulative', 'price_Y_cumulative', 'is_volatility_mitigator_on']
+    BIG_INT_COLUMNS = ['reserve_X', 'reserve_Y', 'k', 'price_X_cumulative', 'price_Y_cumulative']
+
+    def __init__(self, capacity: int = 1024) -> None:
+        self.size = 0
+        self.capacity = capacity
+        self.transaction_id = np.empty(capacity, dtype=np.int64)
+        self.big_int_columns = {column: BigIntColumn(capacity) for column in self.BIG_INT_COLUMNS}
+        self.is_volatility_mitigator_on = np.empty(capacity, dtype=np.bool_)
+
+
+    def __len__(self):
+        return self.size
+
+
+    def record(self, transaction_id, reserve_X: int, reserve_Y: int, k: int, price_X_cumulative: int, price_Y_cumulative: int, is_volatility_mitigator_on: bool):
+        if self.size == self.capacity:
+            self.grow(self.capacity * 2)
+
+        index = self.size
+
+        # ids are integer counters in most of the runs, but uuids are used by the dynamic simulations
+        if self.transaction_id.dtype != object and not isinstance(transaction_id, (int, np.integer)):
+            self.transaction_id = self.transaction_id.astype(object)
+
+        self.transaction_id[index] = transaction_id
+        self.big_int_columns['reserve_X'].set(index, reserve_X)
+        self.big_int_columns['reserve_Y'].set(index, reserve_Y)
+        self.big_int_columns['k'].set(index, k)
+        self.big_int_columns['price_X_cumulative'].set(index, price_X_cumulative)
+        self.big_int_columns['price_Y_cumulative'].set(index, price_Y_cumulative)
+        self.is_volatility_mitigator_on[index] = is_volatility_mitigator_on
+
+        self.size += 1
+
+
+    def grow(self, capacity: int):
+        transaction_id = np.empty(capacity, dtype=self.transaction_id.dtype)
+        transaction_id[:self.size] = self.transaction_id[:self.size]
+        self.transaction_id = transaction_id
+
+        is_volatility_mitigator_on = np.empty(capacity, dtype=np.bool_)
+        is_volatility_mitigator_on[:self.size] = self.is_volatility_mitigator_on[:self.size]
+        self.is_volatility_mitigator_on = is_volatility_mitigator_on
+
+        for column in self.big_int_columns.values():
+            column.grow(capacity)
+
+        self.capacity = capacity
+
+
+    def limbs(self, column: str) -> np.ndarray:
+        return self.big_int_columns[column].limbs(self.size)
+
+
+    def to_dataframe(self) -> pd.DataFrame:
+        data = {'transaction_id': self.transaction_id[:self.size]}
+
+        for column in self.BIG_INT_COLUMNS:
+            data[column] = self.big_int_columns[column].to_object_array(self.size)
+
+        data['is_volatility_mitigator_on'] = self.is_volatility_mitigator_on[:self.size]
+
+        return pd.DataFrame(data, columns=self.COLUMNS)
+
+
+    def to_normalized_dataframe(self) -> pd.DataFrame:
+        """
+        Same as utils.normalize_pool_state, but the cumulative prices are decoded straight from the limbs
+        """
+        data = {'transaction_id': self.transaction_id[:self.size]}
+
+        data['reserve_X'] = contract_decimals_to_float_array(self.big_int_columns['reserve_X'].to_object_array(self.size))
+        data['reserve_Y'] = contract_decimals_to_float_array(self.big_int_columns['reserve_Y'].to_object_array(self.size))
+        # k = reserve_X * reserve_Y, so it has 36 decimals
+        data['k'] = contract_decimals_to_float_array(self.big_int_columns['k'].to_object_array(self.size), 36)
+        data['price_X_cumulative'] = limbs_to_ints(q_decode_144_limbs(self.limbs('price_X_cumulative')))
+        data['price_Y_cumulative'] = limbs_to_ints(q_decode_144_limbs(self.limbs('price_Y_cumulative')))
+
+        data['is_volatility_mitigator_on'] = self.is_volatility_mitigator_on[:self.size]
+
+        return pd.DataFrame(data, columns=self.COLUMNS)
+
+
+    def to_arrow_table(self):
+        pa, _ = require_pyarrow()
+
+        if self.transaction_id.dtype == object:
+            transaction_id = pa.array([str(transaction_id) for transaction_id in self.transaction_id[:self.size]], type=pa.string())
+        else:
+            transaction_id = pa.array(self.transaction_id[:self.size])
+
+        arrays = [transaction_id]
+
+        for column in self.BIG_INT_COLUMNS:
+            arrays.append(limbs_to_decimal_array(self.limbs(column), get_arrow_type(column, [])))
+
+        arrays.append(pa.array(self.is_volatility_mitigator_on[:self.size]))
+
+        return pa.Table.from_arrays(arrays, names=self.COLUMNS)
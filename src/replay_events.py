@@ -0,0 +1,131 @@
+from typing import Dict, List, Tuple
+import numpy as np
+import pandas as pd
+
+SWAP = 0
+MINT = 1
+BURN = 2
+
+EVENT_TYPE_CODES = {'SWAP': SWAP, 'MINT': MINT, 'BURN': BURN}
+
+
+class ReplayEvents:
+    """
+    Transactions history compiled once into columns for replays: event type codes, unix timestamps, token indices
+    and exact integer amounts. Iterating yields plain tuples
+    (event_type, timestamp, token_in, token_out, amount_in, amount_X, amount_Y, sender, to, desired_token_in_amount),
+    so a replay doesn't box every row into a Series nor parse the amounts again
+    """
+    def __init__(self, types: np.ndarray, timestamps: np.ndarray, tokens: List[str], token_in: np.ndarray, token_out: np.ndarray,
+                 amount_in: np.ndarray, amount_X: np.ndarray, amount_Y: np.ndarray, sender: np.ndarray, to: np.ndarray, desired_token_in_amount: np.ndarray) -> None:
+        self.types = types
+        self.timestamps = timestamps
+        self.tokens = tokens
+        self.token_in = token_in
+        self.token_out = token_out
+        self.amount_in = amount_in
+        self.amount_X = amount_X
+        self.amount_Y = amount_Y
+        self.sender = sender
+        self.to = to
+        self.desired_token_in_amount = desired_token_in_amount
+
+
+    # transactions_df holds swaps (amount_in, token_in, token_out) and mints/burns (amount<X_INDEX>, amount<Y_INDEX>) with a 'type'
+    # column, in replay order. sender_column, to_column and desired_token_in_amount_column are the columns written as the swaps' sender, to
+    # and desired_token_in_amount (None leaves them empty, the desired amount is amount_in then)
+    @classmethod
+    def from_dataframe(cls, transactions_df: pd.DataFrame, X_INDEX: str, Y_INDEX: str, sender_column: str=None, to_column: str=None,
+                       desired_token_in_amount_column: str=None) -> 'ReplayEvents':
+        string_columns = [column for column in [sender_column, to_column, desired_token_in_amount_column] if column is not None]
+        tokens, columns = compile_columns(transactions_df, X_INDEX, Y_INDEX, string_columns)
+
+        return cls.from_columns(tokens, columns, sender_column, to_column, desired_token_in_amount_column)
+
+
+    # columns as returned by compile_columns (see also pair_history, which caches them)
+    @classmethod
+    def from_columns(cls, tokens: List[str], columns: Dict[str, np.ndarray], sender_column: str=None, to_column: str=None,
+                     desired_token_in_amount_column: str=None) -> 'ReplayEvents':
+        empty = np.full(len(columns['type']), None, dtype=object)
+
+        return cls(columns['type'], columns['timestamp'], tokens, columns['token_in'], columns['token_out'],
+                   columns['amount_in'], columns['amount_X'], columns['amount_Y'],
+                   empty if sender_column is None else columns[sender_column],
+                   empty if to_column is None else columns[to_column],
+                   empty if desired_token_in_amount_column is None else columns[desired_token_in_amount_column])
+
+
+    def __len__(self):
+        return len(self.types)
+
+
+    def __iter__(self):
+        tokens = np.array(self.tokens + [None], dtype=object)
+
+        return zip(self.types.tolist(), self.timestamps.tolist(), tokens[self.token_in].tolist(), tokens[self.token_out].tolist(),
+                   self.amount_in.tolist(), self.amount_X.tolist(), self.amount_Y.tolist(), self.sender.tolist(), self.to.tolist(),
+                   self.desired_token_in_amount.tolist())
+
+
+# token names and the columns of the events: type codes, unix timestamps, token indices (-1 for mints and burns), exact amounts
+# and the swaps' string_columns (None for missing values and the other events)
+def compile_columns(transactions_df: pd.DataFrame, X_INDEX: str, Y_INDEX: str, string_columns: List[str]) -> Tuple[List[str], Dict[str, np.ndarray]]:
+    types = transactions_df['type'].map(EVENT_TYPE_CODES).to_numpy(dtype=np.int8)
+    timestamps = transactions_df['timestamp'].to_numpy(dtype='datetime64[ns]').astype(np.int64) // 1000000000
+
+    is_swap = types == SWAP
+    is_liquidity = ~is_swap
+    swaps_count = is_swap.sum()
+
+    tokens, token_codes = np.unique(np.concatenate([transactions_df['token_in'].to_numpy(dtype=object)[is_swap],
+                                                    transactions_df['token_out'].to_numpy(dtype=object)[is_swap]]).astype(str), return_inverse=True)
+    token_in = np.full(len(types), -1, dtype=np.int8)
+    token_out = np.full(len(types), -1, dtype=np.int8)
+    token_in[is_swap] = token_codes[:swaps_count]
+    token_out[is_swap] = token_codes[swaps_count:]
+
+    columns = {
+        'type': types,
+        'timestamp': timestamps,
+        'token_in': token_in,
+        'token_out': token_out,
+        'amount_in': to_exact_ints(transactions_df['amount_in'], is_swap),
+        'amount_X': to_exact_ints(transactions_df[f'amount{X_INDEX}'], is_liquidity),
+        'amount_Y': to_exact_ints(transactions_df[f'amount{Y_INDEX}'], is_liquidity)
+    }
+
+    for column in string_columns:
+        columns[column] = get_column(transactions_df, column, is_swap)
+
+    return tokens.tolist(), columns
+
+
+# exact values (int() of the expanded decimals, as the replays did per row) of the selected rows, None for the others
+def to_exact_ints(column: pd.Series, selected: np.ndarray) -> np.ndarray:
+    values = np.full(len(column), None, dtype=object)
+    values[selected] = np.frompyfunc(int, 1, 1)(column.to_numpy(dtype=object)[selected])
+
+    return values
+
+
+def get_column(transactions_df: pd.DataFrame, column: str, selected: np.ndarray) -> np.ndarray:
+    values = np.full(len(transactions_df), None, dtype=object)
+    selected = selected & transactions_df[column].notnull().to_numpy()
+    values[selected] = transactions_df[column].to_numpy(dtype=object)[selected]
+
+    return values
+
+
+# feeds the events to the swap_at, mint_at and burn_at methods of target (an AMM or a MultiOracleSimulation),
+# the index of an event is its transaction id
+def feed_events(target, events, slippage):
+    swap_at, mint_at, burn_at = target.swap_at, target.mint_at, target.burn_at
+
+    for id, (event_type, timestamp, token_in, token_out, amount_in, amount_X, amount_Y, sender, to, desired_token_in_amount) in enumerate(events):
+        if event_type == SWAP:
+            swap_at(id, timestamp, token_in, token_out, amount_in, slippage, sender, to, desired_token_in_amount)
+        elif event_type == MINT:
+            mint_at(amount_X, amount_Y, timestamp, id)
+        else:
+            burn_at(amount_X, amount_Y, timestamp, id)
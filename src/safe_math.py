@@ -1,3 +1,5 @@
+import numpy as np
+
 # todo: move all methods to big_numbers.py
 
 
@@ -38,6 +40,33 @@ def q_decode_144(x: int):
 
     return z
 
+# vectorized q_decode_144 for an object array of python ints (None stays None)
+def q_decode_144_array(x: np.ndarray):
+    x = np.asarray(x, dtype=object)
+    z = np.full(len(x), None, dtype=object)
+
+    present = x != None
+    z[present] = x[present] >> 112
+
+    return z
+
+
+# vectorized q_decode_144 for (size, limbs) little-endian uint64 limbs (see pool_state_recorder.BigIntColumn),
+# returns the limbs of the decoded values
+def q_decode_144_limbs(limbs: np.ndarray):
+    words, bits = divmod(112, 64)
+
+    limbs = limbs[:, words:]
+
+    if limbs.shape[1] == 0:
+        return np.zeros((limbs.shape[0], 1), dtype='<u8')
+
+    z = limbs >> np.uint64(bits)
+    z[:, :-1] |= limbs[:, 1:] << np.uint64(64 - bits)
+
+    return z
+
+
 def q_div(x: int, y: int):
     z = x // y
 
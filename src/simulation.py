@@ -0,0 +1,153 @@
+import copy
+import pickle
+from typing import Dict, List
+
+from amm import AMM
+from blockchain import BlockChain
+from dsw_oracle import DSWOracle
+from settings import BLOCK_TIME, GRANULARITY, PERIOD_SIZE, WINDOW_SIZE
+from transaction_sink import CHUNK_SIZE, OutputFormat, TransactionSink, create_transaction_sink
+from transactions import BurnTransaction, MintTransaction, SwapTransaction, TransactionType
+
+
+class Simulation:
+    """
+    Context of a single pool simulation. Owns the AMM, the DSW oracle, the blockchain and the
+    registries of created transactions, so several pools (or parameter sets) can live in one process.
+    """
+    def __init__(self, X: str, Y: str, reserve0_X: int, reserve0_Y: int, is_volatility_mitigator_on: bool,
+                window_size: int=WINDOW_SIZE, period_size: int=PERIOD_SIZE, granularity: int=GRANULARITY, avg_block_time: int=BLOCK_TIME) -> None:
+        self.swap_transactions: List[SwapTransaction] = []
+        self.mint_transactions: List[MintTransaction] = []
+        self.burn_transactions: List[BurnTransaction] = []
+        self.transaction_sinks: Dict[TransactionType, TransactionSink] = {}
+        self.oracle_branches = []
+
+        self.dsw_oracle = DSWOracle(self, window_size, granularity)
+        self.blockchain = BlockChain(self, avg_block_time)
+        self.amm = AMM(self, X, Y, reserve0_X, reserve0_Y, is_volatility_mitigator_on)
+
+        assert self.dsw_oracle.period_size == period_size, "ERROR: GRANULARITY, PERIOD_SIZE MISMATCH"
+
+
+    def reset(self, X, Y, reserve0_X, reserve0_Y, is_volatility_mitigator_on, window_size, period_size, granularity):
+        self.blockchain.reset_state()
+        self.amm.reset(X, Y, reserve0_X, reserve0_Y, is_volatility_mitigator_on)
+        self.dsw_oracle.reset(window_size, period_size, granularity)
+
+
+    def get_transactions(self, transaction_type: TransactionType):
+        if transaction_type == TransactionType.SWAP:
+            return self.swap_transactions
+        elif transaction_type == TransactionType.MINT:
+            return self.mint_transactions
+        else:
+            return self.burn_transactions
+
+
+    # transactions of the streamed types are written by their sink as soon as their block is created,
+    # instead of being kept in the registry until the end of the run.
+    # cols_to_normalize maps transaction types to the columns of their normalized copies (see TransactionSink)
+    def stream_transactions(self, swaps_filename, mints_filename=None, burns_filename=None, chunk_size=CHUNK_SIZE, output_format=OutputFormat.CSV,
+                            cols_to_normalize: Dict[TransactionType, List[str]]=None):
+        self.transaction_sinks.update(create_transaction_sinks(swaps_filename, mints_filename, burns_filename, chunk_size, output_format, cols_to_normalize))
+
+
+    def add_transaction(self, transaction):
+        if transaction.type not in self.transaction_sinks:
+            self.get_transactions(transaction.type).append(transaction)
+
+
+    def finalize_transaction(self, transaction):
+        sink = self.transaction_sinks.get(transaction.type)
+
+        if sink is not None:
+            sink.write(transaction)
+
+        for branch in self.oracle_branches:
+            branch.finalize_transaction(transaction)
+
+
+    # the swap is also checked against the oracles of the branches which still share this simulation's pool,
+    # a branch deciding differently is forked (see multi_oracle_simulation)
+    def check_oracle_branches(self, swap_transaction, amount_out, reserve_out_final, block_timestamp, block_transaction):
+        for branch in list(self.oracle_branches):
+            branch.check(swap_transaction, amount_out, reserve_out_final, block_timestamp, block_transaction)
+
+
+    # independent copy of the whole simulation state (pool, oracle, blockchain with its pending transactions, transaction registries
+    # and recorded pool states), nothing is shared with the copy. If dsw_oracle is given,
+    # the copy continues with a copy of it instead of this simulation's oracle; transactions are streamed to transaction_sinks
+    def fork(self, dsw_oracle=None, transaction_sinks: Dict[TransactionType, TransactionSink]=None):
+        memo = {id(self.transaction_sinks): {}, id(self.oracle_branches): []}
+
+        if dsw_oracle is not None:
+            memo[id(self.dsw_oracle)] = None
+
+        simulation = copy.deepcopy(self, memo)
+
+        if dsw_oracle is not None:
+            simulation.dsw_oracle = copy.deepcopy(dsw_oracle, memo)
+
+        simulation.transaction_sinks = {} if transaction_sinks is None else transaction_sinks
+
+        return simulation
+
+
+    # writes the transactions which are still pending (as save_all does) and closes the sinks
+    def close_transaction_sinks(self):
+        for transaction in self.blockchain.pending_transactions:
+            self.finalize_transaction(transaction)
+
+        for sink in self.transaction_sinks.values():
+            sink.close()
+
+        self.transaction_sinks = {}
+
+
+    # if timestamp is given, the block clock is moved there first (the pending block is executed as the next transaction would do)
+    def checkpoint(self, timestamp: int=None) -> 'SimulationCheckpoint':
+        if timestamp is not None:
+            self.blockchain.update(timestamp)
+
+        return SimulationCheckpoint(self)
+
+
+class SimulationCheckpoint:
+    """
+    Snapshot of the whole simulation state (pool, oracle observations, block clock, pending transactions and the
+    transactions registries), any number of independent simulations can be restored from it. It can be saved to a file
+    and loaded in another process. Sinks of streamed transactions aren't part of it, a restored simulation streams
+    its transactions only after stream_transactions is called again
+    """
+    def __init__(self, simulation: Simulation) -> None:
+        self.simulation = simulation.fork()
+
+
+    def restore(self) -> Simulation:
+        return self.simulation.fork()
+
+
+    def save(self, filename):
+        with open(filename, 'wb') as f:
+            pickle.dump(self, f)
+
+
+    @staticmethod
+    def load(filename) -> 'SimulationCheckpoint':
+        with open(filename, 'rb') as f:
+            return pickle.load(f)
+
+
+def create_transaction_sinks(swaps_filename, mints_filename=None, burns_filename=None, chunk_size=CHUNK_SIZE, output_format=OutputFormat.CSV,
+                             cols_to_normalize: Dict[TransactionType, List[str]]=None) -> Dict[TransactionType, TransactionSink]:
+    transaction_sinks = {}
+
+    for transaction_type, transaction_class, filename in [(TransactionType.SWAP, SwapTransaction, swaps_filename),
+                                                          (TransactionType.MINT, MintTransaction, mints_filename),
+                                                          (TransactionType.BURN, BurnTransaction, burns_filename)]:
+        if filename is not None:
+            transaction_sinks[transaction_type] = create_transaction_sink(filename, transaction_class.to_list_header(), chunk_size, output_format,
+                                                                          (cols_to_normalize or {}).get(transaction_type))
+
+    return transaction_sinks
@@ -7,6 +7,8 @@ import numpy as np
 import warnings
 import scipy
 
+from big_numbers import expand_to_18_decimals_array
+
 warnings.filterwarnings("ignore",category=UserWarning)
 
 
@@ -53,6 +55,22 @@ class PoissonGenerator:
         return transactions_timestamps
 
 
+    def generate_cycles_transactions(self, start_timestamp: datetime, cycles_count: int) -> np.ndarray:
+        """
+        Generate transactions timestamps of cycles_count consecutive cycles at once: one Poisson draw
+        for the transactions counts of all the cycles and one for all the offsets (datetime64[us] array)
+
+        Keyword_arguments:
+        start_timestamp (datetime) -- starting point of the first cycle
+        cycles_count (int) -- amount of cycles
+        """
+        counts = np.random.poisson(self.mean_occurencies, cycles_count)
+        cycles_starts = np.datetime64(start_timestamp, 'us') + np.arange(cycles_count) * np.timedelta64(self.cycle_size, 'ms')
+        offsets = np.random.randint(self.cycle_size, size=counts.sum()).astype('timedelta64[ms]')
+
+        return np.repeat(cycles_starts, counts) + offsets
+
+
 
 
 class WeibullGenerator:
@@ -71,6 +89,38 @@ class WeibullGenerator:
 
         return values
 
+    # amounts (expanded to 18 decimals) at the cumulative frequencies, with the scale multiplied by scale_deviations.
+    # One ppf call for a whole stream gives the same values as a call per transaction
+    def get_amounts(self, cummulative_frequencies, scale_deviations=1) -> np.ndarray:
+        values = weibull_min.ppf(np.asarray(cummulative_frequencies, dtype=float), self.shape, loc=self.loc, scale=self.scale * np.asarray(scale_deviations))
+
+        return expand_to_18_decimals_array(values)
+
+
+# start_time and the arrival times of a Poisson process with freq events per hour (datetime64[us] array). A gap is dropped, with
+# all the next ones, when the elapsed time plus that gap exceeds periods hours. The gaps are drawn in blocks of 1000 as before, each block
+# is accumulated with one cumulative sum and the gaps are rounded to microseconds like timedelta(hours=gap), so the timestamps are the same
+def get_poisson_timestamps(start_time, periods, freq) -> np.ndarray:
+    blocks = []
+    time_elapsed = 0.0
+
+    while (True):
+        values = scipy.stats.expon.rvs(size=1000, scale=1/freq)
+        elapsed = np.cumsum(np.concatenate([[time_elapsed], values]))[1:]
+        end = np.flatnonzero(elapsed + values > periods)
+
+        if len(end):
+            blocks.append(values[:end[0]])
+            break
+
+        blocks.append(values)
+        time_elapsed = elapsed[-1]
+
+    fraction, hours = np.modf(np.concatenate(blocks))
+    microseconds = hours.astype(np.int64) * 3600000000 + np.round(fraction * 3600000000.0).astype(np.int64)
+
+    return np.datetime64(start_time, 'us') + np.concatenate([[0], np.cumsum(microseconds)]).astype('timedelta64[us]')
+
 
 class Transaction:
     """
@@ -142,6 +192,7 @@ class MonteCarloTransactionSimulator:
         self.token_in_generator = token_in_generator
         self.first_currency = first_currency
         self.second_currency = second_currency
+        # (timestamps, token_in_values) columns of every generated batch of transactions
         self.transaction_history = []
         
     
@@ -159,36 +210,16 @@ class MonteCarloTransactionSimulator:
         self.transaction_history.clear()
     
     def get_timestamps(self, start_time, periods, freq):
-        time_between_events = []
-        time_elapsed = 0
-
-        while (True):
-            values = scipy.stats.expon.rvs(size=1000, scale=1/freq)
-
-            for i in range(len(values)):
-                time_elapsed += values[i]
-
-                if (time_elapsed + values[i] > periods):
-                    timestamps = [start_time]
-                    
-                    for x in time_between_events:
-                        timestamps.append(timestamps[-1] + timedelta(hours=x))
-                        
-                    return timestamps
-
-                time_between_events.append(values[i])
-            #  print(time_elapsed)
+        return get_poisson_timestamps(start_time, periods, freq).tolist()
 
 
     def get_transactions(self, start_time, periods): 
         timestamps = self.get_timestamps(start_time, periods/60, self.frequency_generator.mean_occurencies*60) # periods - hours
         token_in_values = self.token_in_generator.generate_transactions(len(timestamps))
 
-        self.transaction_history.extend(
-            list(zip(timestamps, [self.first_currency]*len(timestamps), token_in_values, [self.second_currency]*len(timestamps)))
-        )
+        self.record_transactions(timestamps, token_in_values)
 
-        print(len(self.transaction_history), len(self.transaction_history[0]))
+        print(self.get_transactions_count())
     #    print(self.transaction_history)
      #   exit(0)
         if (len(timestamps)):
@@ -210,19 +241,41 @@ class MonteCarloTransactionSimulator:
         timestamps = self.frequency_generator.generate_transactions(current_timestamp)
         token_in_values = self.token_in_generator.generate_transactions(len(timestamps))
         
-        # form new transactions and record them into 'transaction history' variable
-        for index in range(len(timestamps)):
-            self.transaction_history.append([
-                    timestamps[index], self.first_currency, token_in_values[index], self.second_currency
-                ]
-            )
+        # record them into 'transaction history' variable
+        self.record_transactions(timestamps, token_in_values)
+
+
+    def generate_cycles_transactions(self, current_timestamp: datetime, cycles_count: int) -> datetime:
+        """
+        Same as calling generate_transactions for cycles_count consecutive cycles, with all the timestamps
+        and token_in values generated at once. Returns the starting point of the next cycle
+
+        Keyword arguments:
+        current_timestamp (datetime) -- initial datetime point of the first cycle
+        cycles_count (int) -- amount of cycles
+        """
+        timestamps = self.frequency_generator.generate_cycles_transactions(current_timestamp, cycles_count)
+        token_in_values = self.token_in_generator.generate_transactions(len(timestamps))
+
+        self.record_transactions(timestamps, token_in_values)
+
+        return current_timestamp + timedelta(milliseconds=self.frequency_generator.cycle_size * cycles_count)
+
+
+    def record_transactions(self, timestamps, token_in_values):
+        self.transaction_history.append((np.asarray(timestamps, dtype='datetime64[us]'), np.asarray(token_in_values, dtype=float)))
+
+
+    def get_transactions_count(self) -> int:
+        return sum(len(timestamps) for timestamps, _ in self.transaction_history)
 
 
     def get_history(self) -> list:
         """
         Get transaction history
         """
-        return self.transaction_history
+        return [[timestamp, self.first_currency, token_in_value, self.second_currency]
+                for timestamps, token_in_values in self.transaction_history for timestamp, token_in_value in zip(timestamps.tolist(), token_in_values.tolist())]
             
             
     def transaction_history_to_csv(self, filename: str):
@@ -232,15 +285,7 @@ class MonteCarloTransactionSimulator:
         Keyword arguments:
         filename (str) -- name of .csv file where to write data
         """
-        # vectorize all transactions into numpy matrix and then make dataframe out of it
-        transactions_matrix = np.array([transaction for transaction in self.transaction_history])
-        transaction_history_df = pd.DataFrame(data=transactions_matrix, columns=[
-            'datetime_timestamp', 'token_in', 'token_in_amount', 'token_out'
-        ])
-        
-
-        # fix transformation of numerical features into string at numpy stage to numerical again
-        transaction_history_df['token_in_amount'] = pd.to_numeric(transaction_history_df['token_in_amount']) 
+        transaction_history_df = self.get_dataframe()
         
         # either append new records to the existing file, or create a new one from existing table
         try:
@@ -251,13 +296,24 @@ class MonteCarloTransactionSimulator:
 
 
     def get_dataframe(self) -> pd.DataFrame:
-        # vectorize all transactions into numpy matrix and then make dataframe out of it
-        transactions_matrix = np.array([transaction for transaction in self.transaction_history])
-        transaction_history_df = pd.DataFrame(data=transactions_matrix, columns=[
-            'datetime_timestamp', 'token_in', 'token_in_amount', 'token_out'
-        ])
+        # typed columns of the batches, the token columns are the same for all the transactions
+        timestamps, token_in_values = self.get_columns()
+
+        return pd.DataFrame({
+            'datetime_timestamp': timestamps,
+            'token_in': self.first_currency,
+            'token_in_amount': token_in_values,
+            'token_out': self.second_currency
+        })
+
 
-        # fix transformation of numerical features into string at numpy stage to numerical again
-        transaction_history_df['token_in_amount'] = pd.to_numeric(transaction_history_df['token_in_amount'])
+    def get_columns(self):
+        """
+        Get timestamps (datetime64[us]) and token_in values (float) of the whole transaction history.
+        The batches are merged into one, so the next calls don't concatenate them again
+        """
+        if len(self.transaction_history) != 1:
+            self.transaction_history = [(np.concatenate([timestamps for timestamps, _ in self.transaction_history] + [np.array([], dtype='datetime64[us]')]),
+                                         np.concatenate([token_in_values for _, token_in_values in self.transaction_history] + [np.array([], dtype=float)]))]
 
-        return transaction_history_df
\ No newline at end of file
+        return self.transaction_history[0]
@@ -0,0 +1,124 @@
+from enum import Enum
+from typing import List
+import pandas as pd
+from arrow_tables import get_arrow_schema, require_pyarrow, rows_to_arrow_table
+from utils import get_normalized_filename, normalize_dataframe
+
+CHUNK_SIZE = 10000
+
+
+class OutputFormat(Enum):
+    CSV = 'csv'
+    PARQUET = 'parquet'
+
+
+class TransactionSink:
+    """
+    Appends transactions to a csv file in chunks of chunk_size rows. Finished transactions don't have to be
+    kept in memory until the end of the run, and the chunks already written survive an interrupted run.
+    Values are written as they are (no dtype inference per chunk), so big integers keep all their digits.
+    If cols_to_normalize is given, every chunk is also written to <filename>_normalized.csv with these
+    columns contracted to floats (as utils.normalize_csv does), without reading the raw file back.
+    """
+    def __init__(self, filename: str, header: List[str], chunk_size: int=CHUNK_SIZE, cols_to_normalize: List[str]=None) -> None:
+        self.filename = filename
+        self.header = header
+        self.chunk_size = chunk_size
+        self.rows = []
+        self.count = 0
+
+        self.init_output()
+        self.init_normalized_output(cols_to_normalize)
+
+
+    # starts the file, the rows are appended to it in chunks
+    def init_output(self):
+        pd.DataFrame(columns=self.header).to_csv(self.filename, index=False)
+
+
+    def init_normalized_output(self, cols_to_normalize):
+        self.cols_to_normalize = cols_to_normalize
+        self.normalized_filename = None
+
+        if cols_to_normalize is not None:
+            self.normalized_filename = get_normalized_filename(self.filename)
+            pd.DataFrame(columns=self.header).to_csv(self.normalized_filename, index=False)
+
+
+    def write(self, transaction):
+        self.write_row(transaction.to_list())
+
+
+    def write_row(self, row):
+        self.rows.append(row)
+
+        if len(self.rows) >= self.chunk_size:
+            self.flush()
+
+
+    def flush(self):
+        if len(self.rows) == 0:
+            return
+
+        chunk_df = pd.DataFrame(self.rows, columns=self.header, dtype=object)
+        chunk_df.to_csv(self.filename, mode='a', header=False, index=False)
+        self.write_normalized_chunk(chunk_df)
+
+        self.count += len(self.rows)
+        self.rows = []
+
+
+    def write_normalized_chunk(self, chunk_df):
+        if self.normalized_filename is not None:
+            normalize_dataframe(chunk_df, self.cols_to_normalize).to_csv(self.normalized_filename, mode='a', header=False, index=False)
+
+
+    def close(self):
+        self.flush()
+
+
+class ParquetTransactionSink(TransactionSink):
+    """
+    Writes every chunk as a row group of a parquet file; big integers are stored as decimals with scale 0.
+    The file is readable only after close().
+    """
+    # the file is created with the first chunk, its schema is inferred from it
+    def init_output(self):
+        require_pyarrow()
+
+        self.schema = None
+        self.writer = None
+
+
+    def flush(self):
+        if len(self.rows) == 0:
+            return
+
+        # the schema is inferred from the first chunk (integer or uuid ids) and kept for the whole file
+        if self.writer is None:
+            _, pq = require_pyarrow()
+            self.schema = get_arrow_schema(self.header, self.rows)
+            self.writer = pq.ParquetWriter(self.filename, self.schema)
+
+        self.writer.write_table(rows_to_arrow_table(self.rows, self.schema))
+        self.write_normalized_chunk(pd.DataFrame(self.rows, columns=self.header, dtype=object))
+
+        self.count += len(self.rows)
+        self.rows = []
+
+
+    def close(self):
+        self.flush()
+
+        if self.writer is None:
+            _, pq = require_pyarrow()
+            self.writer = pq.ParquetWriter(self.filename, get_arrow_schema(self.header, []))
+
+        self.writer.close()
+
+
+def create_transaction_sink(filename: str, header: List[str], chunk_size: int=CHUNK_SIZE, output_format: OutputFormat=OutputFormat.CSV, cols_to_normalize: List[str]=None) -> TransactionSink:
+    if output_format == OutputFormat.PARQUET:
+        return ParquetTransactionSink(filename, header, chunk_size, cols_to_normalize)
+
+    return TransactionSink(filename, header, chunk_size, cols_to_normalize)
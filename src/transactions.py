@@ -1,11 +1,9 @@
-from typing import List
 from enum import Enum
-import pandas as pd
 import logging
 from trading_simulation import Transaction as GenTransaction
-import dsw_oracle
-from volatility_mitigation import VolatilityMitigatorCheckStatus
+from volatility_mitigation import MitigatorCheck, VolatilityMitigatorCheckStatus
 from big_numbers import expand_to_18_decimals
+from transaction_sink import CHUNK_SIZE, OutputFormat, create_transaction_sink
 
 
 logger = logging.getLogger(__name__)
@@ -28,6 +26,8 @@ class TransactionType(Enum):
 
 
 class Transaction:
+    __slots__ = ('amm', 'id', 'block_timestamp', 'timestamp', 'block_number', 'status')
+
     def __init__(self, amm, id) -> None:
         self.amm = amm
         self.id = id
@@ -38,50 +38,81 @@ class Transaction:
         self.status = TransactionStatus.PENDING
 
 
+    @classmethod
+    def save_all(cls, instances, filename, chunk_size=CHUNK_SIZE, output_format=OutputFormat.CSV, cols_to_normalize=None):
+        logger.info(f"Saving {cls.type.name.lower()}s... Total count: {len(instances)}")
+
+        sink = create_transaction_sink(filename, cls.to_list_header(), chunk_size, output_format, cols_to_normalize)
+
+        for transaction in instances:
+            sink.write(transaction)
+
+        sink.close()
+
+
 
-class SwapTransaction(Transaction):
-    instances = []
+class SwapTransaction(Transaction, MitigatorCheck):
+    # kept for every swap until the end of the run, so only the fields that are always set get a slot;
+    # the volatility mitigator diagnostics are allocated only for the swaps it actually checked
+    __slots__ = ('token_in', 'token_out', 'token_in_amount', 'token_out_amount', 'sender', 'to', 'amount_out_min', 'system_fee',
+                 'mitigator_check_status', 'mitigator_diagnostics', 'sequence_swap_cnt', 'attempt_cnt', 'desired_token_in_amount')
+
+    gas_fee = expand_to_18_decimals(150)
+    type = TransactionType.SWAP
 
     def __init__(self, transaction: GenTransaction, slippage, amm, id, save_transaction=True) -> None:
         super().__init__(amm, id)
 
-        self.timestamp = int(transaction.datetime_timestamp.timestamp())
-        self.token_in = transaction.token_in
-        self.token_out = transaction.token_out
-        self.token_in_amount = transaction.token_in_amount
-        self.token_out_amount = transaction.token_out_amount
-        self.txd = id
-        self.sender = transaction.sender
-        self.to = transaction.to
+        self.init_values(int(transaction.datetime_timestamp.timestamp()), transaction.token_in, transaction.token_out, transaction.token_in_amount, slippage,
+                         transaction.sender, transaction.to, transaction.token_out_amount, transaction.sequence_swap_cnt, transaction.attempt_cnt,
+                         transaction.desired_token_in_amount)
+
+        if save_transaction:
+            self.amm.simulation.add_transaction(self)
+
+
+    # swap built straight from its values (unix timestamp, exact amount), without a trading_simulation.Transaction.
+    # As there, a missing desired_token_in_amount falls back to token_in_amount
+    @classmethod
+    def from_values(cls, amm, id, timestamp: int, token_in: str, token_out: str, token_in_amount: int, slippage, sender=None, to=None,
+                    desired_token_in_amount=None) -> 'SwapTransaction':
+        swap_transaction = cls.__new__(cls)
+        Transaction.__init__(swap_transaction, amm, id)
+
+        swap_transaction.init_values(timestamp, token_in, token_out, token_in_amount, slippage, sender, to,
+                                     desired_token_in_amount=desired_token_in_amount or token_in_amount)
+        amm.simulation.add_transaction(swap_transaction)
+
+        return swap_transaction
+
+
+    def init_values(self, timestamp: int, token_in: str, token_out: str, token_in_amount: int, slippage, sender=None, to=None, token_out_amount=None,
+                    sequence_swap_cnt=0, attempt_cnt=0, desired_token_in_amount=None):
+        self.timestamp = timestamp
+        self.token_in = token_in
+        self.token_out = token_out
+        self.token_in_amount = token_in_amount
+        self.token_out_amount = token_out_amount
+        self.sender = sender
+        self.to = to
 
         (reserve_in, reserve_out) = self.get_reserves()
         self.amount_out_min = self.get_amount_out(self.token_in_amount, reserve_in, reserve_out) * (100 - slippage) // 100
-        self.gas_fee = expand_to_18_decimals(150)
-        self.additional = None
-        self.oracle_amount_out = None
-        self.oracle_price = None
-        self.slice_factor = None
-        self.slice_factor_curve = None
-        self.out_amounts_diff = None
         self.system_fee = None
-        self.mitigator_check_status = VolatilityMitigatorCheckStatus.NOT_REACHED
-        self.type = TransactionType.SWAP
+        self.reset_mitigator_check()
 
-        self.sequence_swap_cnt = transaction.sequence_swap_cnt
-        self.attempt_cnt = transaction.attempt_cnt
-        self.desired_token_in_amount = transaction.desired_token_in_amount
-
-        if save_transaction:
-            self.__class__.instances.append(self)
+        self.sequence_swap_cnt = sequence_swap_cnt
+        self.attempt_cnt = attempt_cnt
+        self.desired_token_in_amount = desired_token_in_amount
 
     
-    def get_amount_out(self, amount_in: int, reserve_in: int, reserve_out: int):
-        amount_in_with_fee = amount_in * 990
-        numerator = amount_in_with_fee * reserve_out
-        denominator = reserve_in * 1000 + amount_in_with_fee
-        amount_out = numerator // denominator
+    @property
+    def txd(self):
+        return self.id
 
-        return amount_out
+
+    def get_amount_out(self, amount_in: int, reserve_in: int, reserve_out: int):
+        return get_amount_out(amount_in, reserve_in, reserve_out)
 
 
     def get_reserves(self):
@@ -99,108 +130,15 @@ class SwapTransaction(Transaction):
         self.status = self.try_execute(block_timestamp, block_number)
 
 
-    def check_execute_status(self, block_timestamp):
-        reserve_in, reserve_out = self.get_reserves()
-        amount_out = self.token_out_amount = self.get_amount_out(self.token_in_amount, reserve_in, reserve_out) # amount calculated based on current reserves (from amount_in - 1%)
-        
-        if amount_out >= reserve_out:
-            return TransactionStatus.NOT_ENOUGH_RESERVES
-
-        # if amount_out < self.amount_out_min:
-        #     return TransactionStatus.EXCEEDED_MAX_SLIPPAGE
-
-        balance_in = reserve_in + self.token_in_amount
-        balance_out = reserve_out - amount_out
-
-        balance_in_adjusted = balance_in * 1000 - self.token_in_amount * 10
-        balance_out_adjusted = balance_out * 1000 # todo: refactor
-
-        if self.amm.k_last * 1000 * 1000 > balance_in_adjusted * balance_out_adjusted: # todo:remove one * 1000 from out
-            return TransactionStatus.K_ERROR
-    
-        if self.token_in == self.amm.X:
-            # in case in token0 is a SEC, take the 0.4% of token1 out and leave whole 1% of retained token0 fee in in the pool
-            system_fee = amount_out * 4 // 1000
-        else:
-            # otherwise take the 40% out of 1% retained token0 fee leaving in the pool remaining 60% of the fee (0.6% in total)
-            system_fee = self.token_in_amount * 4 // 1000
-
-        # check if there are enough reserve to perform the swap
-        if self.token_in == self.amm.X:
-            if self.amm.reserve_Y <= amount_out + system_fee:
-                return TransactionStatus.NOT_ENOUGH_RESERVES
-        else:
-            if self.amm.reserve_X <= amount_out or self.amm.reserve_Y + self.token_in_amount <= system_fee: # Note: second check is redundant
-                return TransactionStatus.NOT_ENOUGH_RESERVES
-            
-        # compute the final out_reserve
-        if self.token_in == self.amm.X:
-            reserve_out_final = self.amm.reserve_Y - amount_out - system_fee
-            assert reserve_out_final > 0, 'Invalid reserve_out_final Y'
-        else:
-            reserve_out_final = self.amm.reserve_X - amount_out 
-            assert reserve_out_final > 0, 'Invalid reserve_out_final X'
-        
-        self.amm.update_pair(block_timestamp)
-
-        
-        if self.amm.is_volatility_mitigator_on == False:
-            self.mitigator_check_status = VolatilityMitigatorCheckStatus.MITIGATOR_OFF
-            block_transaction = False
-        else:
-            block_transaction = self.amm.volatility_mitigator.mitigate(self.token_in, self.token_out, self.token_in_amount, amount_out, reserve_out_final, block_timestamp, self)
-
-        self.amm.reverse_state()
-        if block_transaction:
-            return TransactionStatus.BLOCKED_BY_VOLATILITY_MITIGATION
-        
-        return TransactionStatus.SUCCESS
-
-
     def try_execute(self, block_timestamp, block_number):
         self.block_timestamp = block_timestamp
         self.block_number = block_number
 
-        reserve_in, reserve_out = self.get_reserves()
-        amount_out = self.token_out_amount = self.get_amount_out(self.token_in_amount, reserve_in, reserve_out) # amount calculated based on current reserves (from amount_in - 1%)
-        
-        if amount_out >= reserve_out:
-            return TransactionStatus.NOT_ENOUGH_RESERVES
-
-        if amount_out < self.amount_out_min:
-            return TransactionStatus.EXCEEDED_MAX_SLIPPAGE
-
-        balance_in = reserve_in + self.token_in_amount
-        balance_out = reserve_out - amount_out
-
-        balance_in_adjusted = balance_in * 1000 - self.token_in_amount * 10
-        balance_out_adjusted = balance_out * 1000 # todo: refactor
+        amount_out, reserve_out_final, status = check_swap_reserves(self.amm, self.token_in, self.token_in_amount, self.amount_out_min)
+        self.token_out_amount = amount_out # amount calculated based on current reserves (from amount_in - 1%)
 
-        if self.amm.k_last * 1000 * 1000 > balance_in_adjusted * balance_out_adjusted: # todo:remove one * 1000 from out
-            return TransactionStatus.K_ERROR
-    
-        if self.token_in == self.amm.X:
-            # in case in token0 is a SEC, take the 0.4% of token1 out and leave whole 1% of retained token0 fee in in the pool
-            system_fee = amount_out * 4 // 1000
-        else:
-            # otherwise take the 40% out of 1% retained token0 fee leaving in the pool remaining 60% of the fee (0.6% in total)
-            system_fee = self.token_in_amount * 4 // 1000
-
-        # check if there are enough reserve to perform the swap
-        if self.token_in == self.amm.X:
-            if self.amm.reserve_Y <= amount_out + system_fee:
-                return TransactionStatus.NOT_ENOUGH_RESERVES
-        else:
-            if self.amm.reserve_X <= amount_out or self.amm.reserve_Y + self.token_in_amount <= system_fee: # Note: second check is redundant
-                return TransactionStatus.NOT_ENOUGH_RESERVES
-            
-        # compute the final out_reserve
-        if self.token_in == self.amm.X:
-            reserve_out_final = self.amm.reserve_Y - amount_out - system_fee
-            assert reserve_out_final > 0, 'Invalid reserve_out_final Y'
-        else:
-            reserve_out_final = self.amm.reserve_X - amount_out 
-            assert reserve_out_final > 0, 'Invalid reserve_out_final X'
+        if status is not None:
+            return status
 
         self.amm.update_pair(block_timestamp)
         
@@ -208,7 +146,8 @@ class SwapTransaction(Transaction):
             self.mitigator_check_status = VolatilityMitigatorCheckStatus.MITIGATOR_OFF
         else:
             block_transaction = self.amm.volatility_mitigator.mitigate(self.token_in, self.token_out, self.token_in_amount, amount_out, reserve_out_final, block_timestamp, self)
-            dsw_oracle.update(block_timestamp)
+            self.amm.simulation.check_oracle_branches(self, amount_out, reserve_out_final, block_timestamp, block_transaction)
+            self.amm.simulation.dsw_oracle.update(block_timestamp)
 
             if block_transaction:
                 self.amm.reverse_state()
@@ -223,6 +162,7 @@ class SwapTransaction(Transaction):
             self.amm.update_reserve_Y(self.token_in_amount)
             self.amm.update_reserve_X(-amount_out)
         
+        system_fee = get_system_fee(self.amm, self.token_in, self.token_in_amount, amount_out)
         self.amm.update_reserve_Y(-system_fee) 
         self.system_fee = system_fee
         
@@ -233,36 +173,91 @@ class SwapTransaction(Transaction):
     def to_list_header():
         return ['id', 'token_in', 'token_out', 'token_in_amount', 'token_out_amount_min', 'token_out_amount' , 'system_fee', 'mitigator_check_status', 'oracle_amount_out', 'oracle_price', 'out_amount_diff', 'slice_factor', 'slice_factor_curve', 'status', 'block_number', 'block_timestamp', 'transaction_timestamp', 'txd', 'sender', 'to', 'sequence_swap_cnt', 'attempt_cnt', 'desired_token_in_amount']
 
-    def to_list(self):
-        return [self.id, self.token_in, self.token_out, self.token_in_amount, self.amount_out_min, self.token_out_amount, self.system_fee, self.mitigator_check_status.name, self.oracle_amount_out, self.oracle_price, self.out_amounts_diff, self.slice_factor, self.slice_factor_curve, self.status.name, self.block_number, self.block_timestamp, self.timestamp, self.txd, self.sender, self.to, self.sequence_swap_cnt, self.attempt_cnt, self.desired_token_in_amount]
+    # mitigator_check replaces the swap's own mitigator check status and diagnostics (rows of the oracle branches)
+    def to_list(self, mitigator_check: MitigatorCheck=None):
+        check = self if mitigator_check is None else mitigator_check
 
-    @staticmethod
-    def save_all(filename):
-        logger.info("Saving swaps... Total count: " + str(len(SwapTransaction.instances)))
+        return [self.id, self.token_in, self.token_out, self.token_in_amount, self.amount_out_min, self.token_out_amount, self.system_fee, check.mitigator_check_status.name, check.oracle_amount_out, check.oracle_price, check.out_amounts_diff, check.slice_factor, check.slice_factor_curve, self.status.name, self.block_number, self.block_timestamp, self.timestamp, self.txd, self.sender, self.to, self.sequence_swap_cnt, self.attempt_cnt, self.desired_token_in_amount]
+
+
+def get_amount_out(amount_in: int, reserve_in: int, reserve_out: int):
+    amount_in_with_fee = amount_in * 990
+    numerator = amount_in_with_fee * reserve_out
+    denominator = reserve_in * 1000 + amount_in_with_fee
+    amount_out = numerator // denominator
+
+    return amount_out
+
+
+# amount out, final reserve of the token out and the failed status (None if the swap passes) of the reserves, slippage, K and
+# fee checks of a swap of amount_in on the current reserves of the amm, in the order try_execute applies them
+def check_swap_reserves(amm, token_in: str, amount_in: int, amount_out_min: int=0):
+    if token_in == amm.X:
+        reserve_in, reserve_out = amm.reserve_X, amm.reserve_Y
+    else:
+        reserve_in, reserve_out = amm.reserve_Y, amm.reserve_X
 
-        transaction_history_list:List[SwapTransaction] = []
-        # append all new records to the dataframe
-        for transaction in SwapTransaction.instances:
-            transaction_history_list.append(transaction.to_list())
-                                                
-        history_df = pd.DataFrame(transaction_history_list, columns=SwapTransaction.to_list_header())
+    amount_out = get_amount_out(amount_in, reserve_in, reserve_out)
 
-        history_df.to_csv(filename, index=False)
+    if amount_out >= reserve_out:
+        return amount_out, None, TransactionStatus.NOT_ENOUGH_RESERVES
+
+    if amount_out < amount_out_min:
+        return amount_out, None, TransactionStatus.EXCEEDED_MAX_SLIPPAGE
+
+    balance_in = reserve_in + amount_in
+    balance_out = reserve_out - amount_out
+
+    balance_in_adjusted = balance_in * 1000 - amount_in * 10
+    balance_out_adjusted = balance_out * 1000 # todo: refactor
+
+    if amm.k_last * 1000 * 1000 > balance_in_adjusted * balance_out_adjusted: # todo:remove one * 1000 from out
+        return amount_out, None, TransactionStatus.K_ERROR
+
+    system_fee = get_system_fee(amm, token_in, amount_in, amount_out)
+
+    # check if there are enough reserve to perform the swap
+    if token_in == amm.X:
+        if amm.reserve_Y <= amount_out + system_fee:
+            return amount_out, None, TransactionStatus.NOT_ENOUGH_RESERVES
+    else:
+        if amm.reserve_X <= amount_out or amm.reserve_Y + amount_in <= system_fee: # Note: second check is redundant
+            return amount_out, None, TransactionStatus.NOT_ENOUGH_RESERVES
+
+    # compute the final out_reserve
+    if token_in == amm.X:
+        reserve_out_final = amm.reserve_Y - amount_out - system_fee
+        assert reserve_out_final > 0, 'Invalid reserve_out_final Y'
+    else:
+        reserve_out_final = amm.reserve_X - amount_out
+        assert reserve_out_final > 0, 'Invalid reserve_out_final X'
+
+    return amount_out, reserve_out_final, None
+
+
+# fee of a swap taken out of the reserve of Y
+def get_system_fee(amm, token_in: str, amount_in: int, amount_out: int):
+    if token_in == amm.X:
+        # in case in token0 is a SEC, take the 0.4% of token1 out and leave whole 1% of retained token0 fee in in the pool
+        return amount_out * 4 // 1000
+
+    # otherwise take the 40% out of 1% retained token0 fee leaving in the pool remaining 60% of the fee (0.6% in total)
+    return amount_in * 4 // 1000
 
 
 class BurnTransaction(Transaction):
-    instances = []
+    __slots__ = ('X_amount', 'Y_amount')
 
-    def __init__(self, X_amount, Y_amount, timestamp, amm, id) -> None:
+    type = TransactionType.BURN
+
+    def __init__(self, X_amount, Y_amount, timestamp: int, amm, id) -> None:
         super().__init__(amm, id)
 
-        self.timestamp = int(timestamp.timestamp())
+        self.timestamp = timestamp
         self.X_amount = X_amount
         self.Y_amount = Y_amount
 
-        self.type = TransactionType.SWAP
-
-        self.__class__.instances.append(self)
+        self.amm.simulation.add_transaction(self)
 
     
     def execute(self, block_timestamp, block_number):
@@ -300,31 +295,21 @@ class BurnTransaction(Transaction):
 
     def to_list(self):
         return [self.id, self.X_amount, self.Y_amount, self.timestamp, self.status.name, self.block_number, self.block_timestamp, self.timestamp]
-
-
-    @staticmethod
-    def save_all(filename):
-        transaction_history_list:List[BurnTransaction] = []
-        for transaction in BurnTransaction.instances:
-            transaction_history_list.append(transaction.to_list())
-                                                
-        history_df = pd.DataFrame(transaction_history_list, columns=BurnTransaction.to_list_header()) # todo: refactor (place inside parent class)
-
-        history_df.to_csv(filename, index=False)
         
 
 class MintTransaction(Transaction):
-    instances = []
+    __slots__ = ('X_amount', 'Y_amount')
+
+    type = TransactionType.MINT
 
-    def __init__(self, X_amount, Y_amount, timestamp, amm, id) -> None:
+    def __init__(self, X_amount, Y_amount, timestamp: int, amm, id) -> None:
         super().__init__(amm, id)
 
-        self.timestamp = int(timestamp.timestamp())
+        self.timestamp = timestamp
         self.X_amount = X_amount
         self.Y_amount = Y_amount
-        self.type = TransactionType.MINT
     
-        self.__class__.instances.append(self)
+        self.amm.simulation.add_transaction(self)
 
     def execute(self, block_timestamp, block_number):
         self.status = self.try_execute(block_timestamp, block_number)
@@ -346,17 +331,3 @@ class MintTransaction(Transaction):
 
     def to_list(self):
         return [self.id, self.X_amount, self.Y_amount, self.timestamp, self.status.name, self.block_number, self.block_timestamp, self.timestamp]
-
-
-    @staticmethod
-    def save_all(filename):
-        logger.info("Saving mints... Total count: " + str(len(MintTransaction.instances)))
-
-        transaction_history_list:List[MintTransaction] = []
-        # append all new records to the dataframe
-        for transaction in MintTransaction.instances:
-            transaction_history_list.append(transaction.to_list())
-                                                
-        history_df = pd.DataFrame(transaction_history_list, columns=MintTransaction.to_list_header())
-
-        history_df.to_csv(filename, index=False)
\ No newline at end of file
@@ -1,30 +1,57 @@
+import os
 import re
 import pandas as pd
-from big_numbers import contract_18_decimals_to_float, expand_to_18_decimals
-from safe_math import q_decode_144
+from big_numbers import contract_decimals_to_float_array, expand_to_18_decimals
+from safe_math import q_decode_144_array
+import numpy as np
 import json
 
-def normalize_csv(filename, cols_to_normalize, normalized_filename):
-    df = pd.read_csv(filename)
+def get_normalized_filename(filename):
+    return f'{os.path.splitext(filename)[0]}_normalized.csv'
+
+
+def normalize_dataframe(df, cols_to_normalize):
+    df = df.copy()
 
     for col in cols_to_normalize:
-        df[col] = df[col].apply(contract_18_decimals_to_float)
-    
-    df.to_csv(normalized_filename, index=False)
+        df[col] = contract_decimals_to_float_array(df[col])
+
+    return df
+
+
+def normalize_csv(filename, cols_to_normalize, normalized_filename):
+    df = pd.read_csv(filename, dtype={col: str for col in cols_to_normalize})
+
+    normalize_dataframe(df, cols_to_normalize).to_csv(normalized_filename, index=False)
+
+
+def q_decode_144_column(values):
+    # python's int parser is faster than anything we can do with the digits in numpy, the shift is done for the whole column
+    ints = pd.Series(values, dtype=object).to_numpy(dtype=object, na_value=None, copy=True)
+    ints[ints == ''] = None
+    present = ints != None
+    ints[present] = np.frompyfunc(int, 1, 1)(ints[present])
+
+    return q_decode_144_array(ints)
+
+
+def normalize_pool_state_dataframe(pool_state_df):
+    pool_state_df = pool_state_df.copy()
+
+    pool_state_df['reserve_X'] = contract_decimals_to_float_array(pool_state_df['reserve_X'])
+    pool_state_df['reserve_Y'] = contract_decimals_to_float_array(pool_state_df['reserve_Y'])
+    # k = reserve_X * reserve_Y, so it has 36 decimals
+    pool_state_df['k'] = contract_decimals_to_float_array(pool_state_df['k'], 36)
+    pool_state_df['price_X_cumulative'] = q_decode_144_column(pool_state_df['price_X_cumulative'])
+    pool_state_df['price_Y_cumulative'] = q_decode_144_column(pool_state_df['price_Y_cumulative'])
 
+    return pool_state_df
 
-def normalize_pool_state(pool_state_filename, normalized_filename):
-    pool_state_df = pd.read_csv(pool_state_filename)
 
-    # todo: try optimizing
-    pool_state_df['reserve_X'] = pool_state_df['reserve_X'].apply(contract_18_decimals_to_float)
-    pool_state_df['reserve_Y'] = pool_state_df['reserve_Y'].apply(contract_18_decimals_to_float)
-    pool_state_df['k'] = pool_state_df['k'].apply(contract_18_decimals_to_float)
-    pool_state_df['k'] = pool_state_df['k'].apply(contract_18_decimals_to_float) # second time!!!
-    pool_state_df['price_X_cumulative'] = pool_state_df['price_X_cumulative'].apply(int).apply(q_decode_144)
-    pool_state_df['price_Y_cumulative'] = pool_state_df['price_Y_cumulative'].apply(int).apply(q_decode_144)
+def normalize_pool_state(pool_state_filename, normalized_filename, index=True):
+    pool_state_df = pd.read_csv(pool_state_filename, dtype={col: str for col in ['reserve_X', 'reserve_Y', 'k', 'price_X_cumulative', 'price_Y_cumulative']})
 
-    pool_state_df.to_csv(normalized_filename)
+    normalize_pool_state_dataframe(pool_state_df).to_csv(normalized_filename, index=index)
 
 
 def combine_transactions(transactions1_df, transactions2_df):
@@ -1,7 +1,6 @@
 from enum import Enum
 
 import logging
-import dsw_oracle
 import safe_math
 
 logger = logging.getLogger(__name__)
@@ -13,12 +12,83 @@ class VolatilityMitigatorCheckStatus(Enum):
     NOT_REACHED = 3
 
 
+class MitigatorDiagnostics:
+    __slots__ = ('oracle_amount_out', 'oracle_price', 'slice_factor', 'slice_factor_curve', 'out_amounts_diff')
+
+    def __init__(self) -> None:
+        self.oracle_amount_out = None
+        self.oracle_price = None
+        self.slice_factor = None
+        self.slice_factor_curve = None
+        self.out_amounts_diff = None
+
+
+class MitigatorCheck:
+    """
+    Accessors of the mitigator check status and the lazily allocated diagnostics, shared by the swaps and
+    the checks of the oracle branches (see multi_oracle_simulation)
+    """
+    __slots__ = ()
+
+    def reset_mitigator_check(self):
+        self.mitigator_check_status = VolatilityMitigatorCheckStatus.NOT_REACHED
+        self.mitigator_diagnostics = None
+
+
+    def get_mitigator_diagnostics(self) -> MitigatorDiagnostics:
+        if self.mitigator_diagnostics is None:
+            self.mitigator_diagnostics = MitigatorDiagnostics()
+
+        return self.mitigator_diagnostics
+
+
+    def get_mitigator_diagnostic(self, name: str):
+        if self.mitigator_diagnostics is None:
+            return None
+
+        return getattr(self.mitigator_diagnostics, name)
+
+
+    @property
+    def oracle_amount_out(self):
+        return self.get_mitigator_diagnostic('oracle_amount_out')
+
+    @property
+    def oracle_price(self):
+        return self.get_mitigator_diagnostic('oracle_price')
+
+    @property
+    def slice_factor(self):
+        return self.get_mitigator_diagnostic('slice_factor')
+
+    @property
+    def slice_factor_curve(self):
+        return self.get_mitigator_diagnostic('slice_factor_curve')
+
+    @property
+    def out_amounts_diff(self):
+        return self.get_mitigator_diagnostic('out_amounts_diff')
+
+
+class MitigatorCheckResult(MitigatorCheck):
+    __slots__ = ('mitigator_check_status', 'mitigator_diagnostics')
+
+    def __init__(self) -> None:
+        self.reset_mitigator_check()
+
+
 class VolatilityMitigator:
-    def __init__(self, price_tollerance_threshold) -> None:
+    # swaps are checked against the simulation's oracle, unless the mitigator gets its own one
+    def __init__(self, simulation, price_tollerance_threshold, dsw_oracle=None) -> None:
+        self.simulation = simulation
         self.price_tollerance_threshold = price_tollerance_threshold
+        self.dsw_oracle = dsw_oracle
+
+    def get_dsw_oracle(self):
+        return self.simulation.dsw_oracle if self.dsw_oracle is None else self.dsw_oracle
 
     def mitigate(self, token_in: str, token_out: str, amount_in: int, amount_out: int, reserve_out: int, block_timestamp: int, transaction):
-        if not dsw_oracle.can_consult(block_timestamp):
+        if not self.get_dsw_oracle().can_consult(block_timestamp):
             transaction.mitigator_check_status = VolatilityMitigatorCheckStatus.CANT_CONSULT_ORACLE
             
             return False
@@ -29,39 +99,66 @@ class VolatilityMitigator:
 
 
     def __mitigate(self, token_in: str, token_out: str, amount_in:int, amount_out:int, reserve_out:int, block_timestamp: int, transaction):
-        # Which is the % of amount out relative to the remaining reserve of the token after the swap
-        # slice_factor = 100 * amount_out / reserve_out if reserve_out > amount_out else 100
-        slice_factor = 100 - 100 * (reserve_out - amount_out) // reserve_out if reserve_out > amount_out else 100
+        slice_factor = self.get_slice_factor(amount_out, reserve_out)
 
-        oracle_amount_out, price_average = dsw_oracle.consult(token_in, amount_in, token_out, block_timestamp)
-        transaction.oracle_amount_out = oracle_amount_out # TODO: move in another place
-        transaction.oracle_price = price_average
+        oracle_amount_out, price_average = self.get_dsw_oracle().consult(token_in, amount_in, token_out, block_timestamp)
+        diagnostics = transaction.get_mitigator_diagnostics()
+        diagnostics.oracle_amount_out = oracle_amount_out # TODO: move in another place
+        diagnostics.oracle_price = price_average
 
-        if oracle_amount_out == amount_out:
-            out_amounts_diff = 0
-        else:
-            bigger_amount = max(amount_out, oracle_amount_out)
-            smaller_amount = min(amount_out, oracle_amount_out)
+        # handle case when the sum of both amounts is smaller than 2
+        try:  
+            out_amounts_diff = self.get_out_amounts_diff(amount_out, oracle_amount_out)
+        except ZeroDivisionError as e:
+            logger.warn(e)
+
+            return True
 
-            # handle case when the sum of both amounts is smaller than 2
-            try:  
-                out_amounts_diff = 100 * (bigger_amount - smaller_amount) // ((bigger_amount + smaller_amount)//2)
-            except ZeroDivisionError as e:
-                logger.warn(e)
+        if out_amounts_diff <= 0:
+            return False
+
+        slice_factor_curve = self.get_slice_factor_curve(slice_factor)
+
+        diagnostics.slice_factor = slice_factor
+        diagnostics.slice_factor_curve = slice_factor_curve
+        diagnostics.out_amounts_diff = out_amounts_diff
+
+        return out_amounts_diff > 100 - slice_factor_curve
 
-                return True
+
+    # same decision as mitigate for a swap which can consult the oracle, from the oracle's amount out and without diagnostics
+    def is_blocked(self, amount_out: int, reserve_out: int, oracle_amount_out: int) -> bool:
+        try:
+            out_amounts_diff = self.get_out_amounts_diff(amount_out, oracle_amount_out)
+        except ZeroDivisionError:
+            return True
 
         if out_amounts_diff <= 0:
             return False
 
-        slice_factor_curve = slice_factor * safe_math.sqrt(slice_factor)
+        return out_amounts_diff > self.get_out_amounts_diff_limit(self.get_slice_factor(amount_out, reserve_out))
 
-        if slice_factor_curve > self.price_tollerance_threshold:
-            slice_factor_curve = self.price_tollerance_threshold
 
-        transaction.slice_factor = slice_factor
-        transaction.slice_factor_curve = slice_factor_curve
-        transaction.out_amounts_diff = out_amounts_diff
+    # Which is the % of amount out relative to the remaining reserve of the token after the swap
+    def get_slice_factor(self, amount_out: int, reserve_out: int) -> int:
+        # slice_factor = 100 * amount_out / reserve_out if reserve_out > amount_out else 100
+        return 100 - 100 * (reserve_out - amount_out) // reserve_out if reserve_out > amount_out else 100
 
-        return out_amounts_diff > 100 - slice_factor_curve
 
+    def get_slice_factor_curve(self, slice_factor: int) -> int:
+        return min(slice_factor * safe_math.sqrt(slice_factor), self.price_tollerance_threshold)
+
+
+    # largest difference (%) between the amount out and the oracle's amount out which lets a swap with the slice factor through
+    def get_out_amounts_diff_limit(self, slice_factor: int) -> int:
+        return 100 - self.get_slice_factor_curve(slice_factor)
+
+
+    def get_out_amounts_diff(self, amount_out: int, oracle_amount_out: int) -> int:
+        if oracle_amount_out == amount_out:
+            return 0
+
+        bigger_amount = max(amount_out, oracle_amount_out)
+        smaller_amount = min(amount_out, oracle_amount_out)
+
+        return 100 * (bigger_amount - smaller_amount) // ((bigger_amount + smaller_amount)//2)